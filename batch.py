@@ -0,0 +1,158 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from compile_cache import CompileCache
+from compile_stats import CompileStats
+from two_pass_comp import TwoPassCompiler
+
+
+class BatchResult:
+    """The outcome of compiling one file in a batch."""
+
+    def __init__(self, path, assembly=None, error=None, tokens=0, seconds=0.0, cached=False):
+        self.path = path
+        self.assembly = assembly  # None when compilation failed
+        self.error = error  # 'ExceptionType: message' when compilation failed
+        self.tokens = tokens  # Tokens lexed; 0 for cache hits
+        self.seconds = seconds
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else self.error
+        return f"BatchResult({self.path!r}, {status}, tokens={self.tokens})"
+
+
+# One cache object per directory and process, so its size is only scanned once
+_caches = {}
+
+
+def _open_cache(cache):
+    if cache is None or isinstance(cache, CompileCache):
+        return cache
+    directory, max_bytes = cache
+    if (directory, max_bytes) not in _caches:
+        _caches[directory, max_bytes] = CompileCache(directory, max_bytes)
+    return _caches[directory, max_bytes]
+
+
+def compile_file(path, options=None, cache=None):
+    """Compile one file, capturing compiler and I/O errors in the result instead of raising.
+
+    cache is a CompileCache or a (directory, max_bytes) pair naming one.
+    """
+    options = options or {}
+    cache = _open_cache(cache)
+    stats = CompileStats()
+    start = time.perf_counter()
+    try:
+        with open(path, encoding='utf-8') as f:
+            code = f.read()
+        if cache is not None:
+            key = cache.key(code, options)
+            assembly = cache.get(key)
+            if assembly is not None:
+                return BatchResult(path, assembly, seconds=time.perf_counter() - start, cached=True)
+        assembly = TwoPassCompiler(**options).compile(code, stats)
+    except (RuntimeError, ValueError, OSError) as error:
+        return BatchResult(path, error=f"{type(error).__name__}: {error}",
+                           seconds=time.perf_counter() - start)
+    if cache is not None:
+        try:
+            cache.put(key, assembly)
+        except OSError:
+            pass  # The cache is best-effort; a full or read-only cache directory does not fail the file
+    tokens = stats.phases['lexer'].count
+    return BatchResult(path, assembly, tokens=tokens, seconds=time.perf_counter() - start)
+
+
+def _compile_chunk(paths, options, cache):
+    return [compile_file(path, options, cache) for path in paths]
+
+
+def compile_many(paths, workers=None, options=None, chunksize=None, cache=None):
+    """Compile many files across a process pool and return their BatchResults in input order.
+
+    Files are handed to the workers in chunks so that each round trip
+    amortizes its pickling cost over several files. With workers=1 everything
+    runs in this process. options are passed to TwoPassCompiler(); cache is
+    a (directory, max_bytes) pair for a CompileCache shared by all workers.
+    """
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        return [compile_file(path, options, cache) for path in paths]
+
+    if chunksize is None:
+        chunksize = max(1, len(paths) // (workers * 4))
+    chunks = [paths[start:start + chunksize] for start in range(0, len(paths), chunksize)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_compile_chunk, chunk, options, cache) for chunk in chunks]
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def throughput(results, seconds):
+    """Return (files/sec, tokens/sec) for a batch that took seconds of wall time."""
+    tokens = sum(result.tokens for result in results)
+    return len(results) / seconds, tokens / seconds
+
+
+def main(argv=None):
+    """Compile many source files in parallel, writing <file>.asm next to each one."""
+    parser = argparse.ArgumentParser(description='Compile many programs in parallel.')
+    parser.add_argument('sources', nargs='+', help='source files to compile')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2, 3], default=0,
+                        help='optimization level')
+    parser.add_argument('-r', '--registers', type=int, metavar='N',
+                        help='allocate onto N physical registers')
+    parser.add_argument('--chunksize', type=int, help='files per task sent to a worker')
+    parser.add_argument('--scaling', metavar='N,N,...',
+                        help='instead of writing output, report throughput for each worker count')
+    parser.add_argument('--cache-dir', help='reuse and store compiled output in this directory')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MiB',
+                        help='evict least recently used cache entries beyond this size (default: 256)')
+    args = parser.parse_args(argv)
+    options = {'optimization_level': args.optimization_level, 'num_registers': args.registers}
+    cache = (args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+
+    if args.scaling:
+        for workers in (int(count) for count in args.scaling.split(',')):
+            start = time.perf_counter()
+            results = compile_many(args.sources, workers, options, args.chunksize, cache)
+            files_per_second, tokens_per_second = throughput(results, time.perf_counter() - start)
+            print(f"{workers:>3} workers: {files_per_second:12,.0f} files/sec {tokens_per_second:14,.0f} tokens/sec")
+        return 0
+
+    start = time.perf_counter()
+    results = compile_many(args.sources, args.workers, options, args.chunksize, cache)
+    elapsed = time.perf_counter() - start
+    failures = 0
+    for result in results:
+        if result.ok:
+            with open(result.path + '.asm', 'w', encoding='utf-8') as f:
+                f.write(result.assembly + '\n')
+        else:
+            failures += 1
+            print(f"{result.path}: {result.error}", file=sys.stderr)
+    files_per_second, tokens_per_second = throughput(results, elapsed)
+    print(f"{len(results)} files ({failures} failed) in {elapsed:.3f} s: "
+          f"{files_per_second:,.0f} files/sec, {tokens_per_second:,.0f} tokens/sec", file=sys.stderr)
+    if cache:
+        hits = sum(result.cached for result in results)
+        print(f"cache: {hits} hits, {len(results) - hits - failures} misses", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
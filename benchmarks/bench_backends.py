@@ -0,0 +1,77 @@
+"""Compare executing a program on the assembly VM with running it as Python bytecode.
+
+Run from the repository root: python -m benchmarks.bench_backends
+"""
+import argparse
+import random
+import sys
+import time
+
+import python_backend
+from two_pass_comp import TwoPassCompiler
+from vm import VirtualMachine
+
+
+def generate_program(statements, seed=0, if_density=0.1):
+    """Return an arithmetic program over a small set of variables, with if_density of its statements guarded by an 'if'."""
+    rng = random.Random(seed)
+    names = [f"v{n}" for n in range(16)]
+    lines = [f"{name} = {rng.randint(1, 9)}" for name in names]
+    for _ in range(statements):
+        a, b, c = rng.choice(names), rng.choice(names), rng.choice(names)
+        assignment = f"{a} = ({b} + {rng.randint(1, 9)}) * 3 / ({c} * {c} + 1) + {rng.randint(1, 9)}"
+        if rng.random() < if_density:
+            lines.append(f"if ({rng.choice(names)} > {rng.randint(1, 9)})")
+            assignment = "    " + assignment
+        lines.append(assignment)
+    return "\n".join(lines) + "\n"
+
+
+# Names the language accepts but Python reserves or uses itself; both backends must treat them as plain variables
+RESERVED_NAMES_PROGRAM = """None = 1
+True = 4
+False = None + True
+__builtins__ = 3
+__name__ = __builtins__ * 2
+if (None < True)
+    print = False + __name__
+"""
+
+
+def best_of(repeat, function):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--statements', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    reserved = RESERVED_NAMES_PROGRAM
+    if VirtualMachine(TwoPassCompiler().compile(reserved)).run() != python_backend.run(
+            TwoPassCompiler().compile_to_python(reserved)):
+        raise AssertionError("The VM and the Python backend disagree on names Python reserves")
+
+    source = generate_program(args.statements)
+    machine = VirtualMachine(TwoPassCompiler().compile(source))
+    code = TwoPassCompiler().compile_to_python(source)
+
+    if machine.run() != python_backend.run(code):
+        raise AssertionError("The VM and the Python backend disagree")
+    machine.steps = 0
+    vm_seconds = best_of(args.repeat, machine.run)
+    python_seconds = best_of(args.repeat, lambda: python_backend.run(code))
+    steps = machine.steps // args.repeat
+    print(f"program: {args.statements} statements, {steps} VM instructions per run")
+    print(f"vm:      {vm_seconds * 1000:10.3f} ms  ({steps / vm_seconds:,.0f} instructions/sec)")
+    print(f"python:  {python_seconds * 1000:10.3f} ms  ({vm_seconds / python_seconds:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Compare generating code by rescanning the tokens with generating it from the parsed statements.
+
+Before, two_pass_comp parsed the tokens and then walked them a second time
+with the token state machine that two_pass.py still uses. Now code is
+generated by a single visit over the statements the parser built. The
+phases are timed on their own, and then compile() end to end against the
+rescanning compiler's compile().
+
+Run from the repository root: python -m benchmarks.bench_codegen
+"""
+import argparse
+import sys
+
+import two_pass
+from two_pass_comp import TwoPassCompiler, lex
+
+from benchmarks.bench_backends import best_of, generate_program
+from benchmarks.bench_memory import count_statements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--statements', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    source = generate_program(args.statements)
+    compiler = TwoPassCompiler()
+    rescanning = two_pass.TwoPassCompiler()
+    tokens = lex(source)
+    statements = compiler.parse_instructions(tokens)
+
+    lex_seconds = best_of(args.repeat, lambda: lex(source))
+    parse_seconds = best_of(args.repeat, lambda: compiler.parse_instructions(tokens))
+    rescan_seconds = best_of(args.repeat, lambda: list(rescanning._generate_assembly(tokens)))
+    visit_seconds = best_of(args.repeat, lambda: list(compiler._generate_assembly(statements)))
+    before = lex_seconds + parse_seconds + rescan_seconds
+    after = lex_seconds + parse_seconds + visit_seconds
+    rescan_compile_seconds = best_of(args.repeat, lambda: rescanning.compile(source))
+    compile_seconds = best_of(args.repeat, lambda: compiler.compile(source))
+
+    print(f"program: {count_statements(statements):,} statements, {len(tokens):,} tokens")
+    print(f"lex:   {lex_seconds * 1000:10.3f} ms")
+    print(f"parse: {parse_seconds * 1000:10.3f} ms")
+    print(f"codegen by token rescan: {rescan_seconds * 1000:10.3f} ms  (a third pass over {len(tokens):,} tokens)")
+    print(f"codegen by tree visit:   {visit_seconds * 1000:10.3f} ms  "
+          f"(one visit of {count_statements(statements):,} statements, {rescan_seconds / visit_seconds:.1f}x faster)")
+    print(f"total: {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms ({(after - before) / before * 100:+.1f}%)")
+    print(f"compile() of two_pass:      {rescan_compile_seconds * 1000:10.3f} ms  (lex, then rescan the tokens)")
+    print(f"compile() of two_pass_comp: {compile_seconds * 1000:10.3f} ms  (lex, parse, then visit the statements; "
+          f"{(compile_seconds - rescan_compile_seconds) / rescan_compile_seconds * 100:+.1f}%)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
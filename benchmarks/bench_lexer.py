@@ -0,0 +1,96 @@
+"""Compare the tokens per second of the regex lexer with the NumPy bulk lexer, after checking they agree.
+
+Before timing, both lexers run on a set of edge cases, on random byte
+soup and on generated programs. Every case must give identical token
+kinds and offsets, or the identical error. Any difference is printed and
+the benchmark exits 1. The bulk lexer needs numpy, and without it only
+the regex lexer is timed.
+
+Run from the repository root: python -m benchmarks.bench_lexer
+"""
+import argparse
+import random
+import sys
+
+import bulk_lexer
+from two_pass_comp import lex
+
+from benchmarks.bench_backends import best_of
+from benchmarks.bench_scaling import generate_program
+
+EDGE_CASES = [
+    "", "\n", "x", "x = 1", "12abc = ab12", "while1 = iff + else_", "_ = __1 * 1_",
+    "a==b\nc>=d\ne===f\ng>==h\ni>===j\nk<=l\n",
+    "  x = 1\n    y = 2\n  z = 3\n",
+    "if (a > 1)\n    b = 2\nelse\n    b = 3\nwhile (b < 9)\n    b = b + 1\n",
+    "a\n    b\n  c\n",
+    "x = 1\nif (x > 0)\n    y = 2", "while (x < 3)\n    x = x + 1\n        ",
+    "x = 1\n\n   \n\t\n    y = 2\r\n",
+    "x = 1 $ 2", "  x = 1\n y = 2 $\n", "x = 1\x0c",
+    "é = 1", "٣ = 4",
+]
+# Characters the random cases are drawn from, including ones the lexers reject
+SOUP = "ab12 \t\r\n=><+-*/()_ifelsewh$\x0b"
+
+
+def outcome(lexer, source, line_num=1):
+    try:
+        tokens = lexer(source, line_num=line_num)
+    except RuntimeError as error:
+        return 'error', str(error)
+    return tokens.kinds.tobytes(), list(tokens.starts), list(tokens.ends)
+
+
+def differences(cases):
+    """Yield each (source, line_num) the two lexers disagree on."""
+    for source in cases:
+        for line_num in (1, 7):
+            if outcome(lex, source, line_num) != outcome(bulk_lexer.lex, source, line_num):
+                yield source, line_num
+
+
+def cases(seed=0):
+    rng = random.Random(seed)
+    yield from EDGE_CASES
+    for _ in range(2000):
+        yield ''.join(rng.choice(SOUP) for _ in range(rng.randint(0, 40)))
+    for _ in range(200):
+        lines = [' ' * rng.choice((0, 0, 1, 2, 3, 4))
+                 + rng.choice(('x = 1', 'if (a > b)', 'else', 'while (x < 3)', 'y = a1 + 2b', ''))
+                 for _ in range(rng.randint(1, 8))]
+        yield '\n'.join(lines) + rng.choice(('', '\n'))
+    for if_density in (0.0, 0.3, 0.9):
+        yield generate_program(2000, if_density=if_density, seed=seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if bulk_lexer.available():
+        failed = 0
+        for source, line_num in differences(cases()):
+            failed += 1
+            print(f"lexers disagree from line {line_num} on {source[:60]!r}", file=sys.stderr)
+        if failed:
+            return 1
+        print("differential check: the lexers agree on every case")
+    else:
+        print("numpy is not installed, so only the regex lexer is timed", file=sys.stderr)
+
+    source = generate_program(args.lines)
+    tokens = len(lex(source))
+    print(f"program: {args.lines:,} lines, {len(source) / 2 ** 20:.1f} MiB, {tokens:,} tokens")
+    regex_seconds = best_of(args.repeat, lambda: lex(source))
+    print(f"regex lexer: {regex_seconds * 1000:10.1f} ms {tokens / regex_seconds:>14,.0f} tokens/s")
+    if bulk_lexer.available():
+        bulk_seconds = best_of(args.repeat, lambda: bulk_lexer.lex(source))
+        print(f"bulk lexer:  {bulk_seconds * 1000:10.1f} ms {tokens / bulk_seconds:>14,.0f} tokens/s "
+              f"({regex_seconds / bulk_seconds:.1f}x faster)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
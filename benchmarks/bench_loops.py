@@ -0,0 +1,80 @@
+"""Measure what loop-invariant code motion and strength reduction save on loop-heavy programs.
+
+Each program is compiled at -O1 and at -O2, which adds the loop
+optimizations, and run on the VM. The instruction counts come from the
+VM's step counter and, per loop, from the control-flow graph.
+
+Run from the repository root: python -m benchmarks.bench_loops
+"""
+import argparse
+import random
+import sys
+import time
+
+from cfg import ControlFlowGraph
+from two_pass_comp import TwoPassCompiler
+from vm import VirtualMachine
+
+
+def generate_program(loops, iterations, seed=0):
+    """Return a program of nested counting loops whose bodies mix invariant and varying arithmetic."""
+    rng = random.Random(seed)
+    params = [f"p{n}" for n in range(6)]
+    lines = [f"{name} = {rng.randint(1, 9)}" for name in params]
+    lines.append("total = 0")
+    for _ in range(loops):
+        a, b, c = rng.sample(params, 3)
+        step = rng.randint(1, 3)
+        lines += [
+            "i = 0",
+            f"while (i < {iterations} * {step})",
+            f"    total = total + ({a} * {b} + {c}) * i",
+            "    j = 0",
+            f"    while (j < {a} + 2)",
+            f"        total = total + i * 4 - ({b} - {c}) * j + i * 4 + i * 4",
+            "        j = j + 1",
+            f"    i = i + {step}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--loops', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    source = generate_program(args.loops, args.iterations)
+    results = {}
+    for level in (1, 2):
+        compiler = TwoPassCompiler(optimization_level=level)
+        assembly = compiler.compile(source)
+        machine = VirtualMachine(assembly)
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            variables = machine.run()
+            best = min(best, time.perf_counter() - start)
+        graph = ControlFlowGraph(assembly.splitlines())
+        loops = graph.loops()
+        innermost = [body for body in loops.values()
+                     if not any(other < body for other in loops.values())]
+        static = sum(graph.instruction_count(body) for body in innermost) / max(len(innermost), 1)
+        results[level] = variables
+        print(f"-O{level}: {machine.steps // args.repeat:>12,} instructions per run  "
+              f"{best * 1000:9.3f} ms  {len(loops)} loops, "
+              f"{static:.1f} instructions per inner-loop iteration")
+        if level == 1:
+            before, before_seconds = machine.steps, best
+        else:
+            print(f"       {(machine.steps - before) / before * 100:+.1f}% instructions, "
+                  f"{(best - before_seconds) / before_seconds * 100:+.1f}% time")
+    if results[1] != results[2]:
+        print("-O1 and -O2 disagree", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
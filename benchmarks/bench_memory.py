@@ -0,0 +1,118 @@
+"""Compare the memory held by tuple tokens and dict statements against TokenBuffer and slotted nodes.
+
+Run from the repository root: python -m benchmarks.bench_memory
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from expressions import Assignment, If, While
+from two_pass_comp import TwoPassCompiler, lex, mark_indentation, tokenize
+
+
+def generate_program(statements, seed=0):
+    rng = random.Random(seed)
+    names = [f"value{n}" for n in range(40)]
+    lines = [f"{name} = {n}" for n, name in enumerate(names)]
+    while len(lines) < statements:
+        terms = [rng.choice(names) if rng.random() < 0.6 else str(rng.randint(0, 999)) for _ in range(4)]
+        expression = f"({terms[0]} + {terms[1]}) * {terms[2]} - {terms[3]}"
+        kind = rng.random()
+        if kind < 0.1:
+            lines.append(f"if ({rng.choice(names)} > {rng.randint(0, 99)})")
+            lines.append(f"    {rng.choice(names)} = {expression}")
+            if kind < 0.04:
+                lines.append("else")
+                lines.append(f"    {rng.choice(names)} = {expression}")
+        elif kind < 0.13:
+            lines.append(f"while ({rng.choice(names)} < {rng.randint(0, 99)})")
+            lines.append(f"    {rng.choice(names)} = {expression}")
+        else:
+            lines.append(f"{rng.choice(names)} = {expression}")
+    return "\n".join(lines) + "\n"
+
+
+def retained(build):
+    """Return (result, bytes still allocated once build() returns)."""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def as_dicts(statements):
+    """Rebuild the statement dicts that parse_instructions() used to return."""
+    converted = []
+    for statement in statements:
+        if isinstance(statement, Assignment):
+            converted.append({'type': 'assignment', 'lhs': statement.lhs, 'rhs': statement.rhs})
+        elif isinstance(statement, If):
+            converted.append({'type': 'if', 'condition': statement.condition, 'body': as_dicts(statement.body),
+                              'orelse': as_dicts(statement.orelse)})
+        elif isinstance(statement, While):
+            converted.append({'type': 'while', 'condition': statement.condition, 'body': as_dicts(statement.body)})
+    return converted
+
+
+def count_statements(statements):
+    return sum(1 + count_statements(getattr(statement, 'body', ())) + count_statements(getattr(statement, 'orelse', ()))
+               for statement in statements)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--statements', type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    source = generate_program(args.statements)
+    compiler = TwoPassCompiler()
+
+    start = time.perf_counter()
+    tuples = [(kind, value) for kind, value, _, _ in mark_indentation(tokenize(source))]
+    tuple_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    buffer = lex(source)
+    buffer_seconds = time.perf_counter() - start
+    if list(buffer) != tuples:
+        print("TokenBuffer and tuple tokens differ", file=sys.stderr)
+        return 1
+    del tuples, buffer
+
+    tracemalloc.start()
+    tuples, tuple_bytes = retained(
+        lambda: [(kind, value) for kind, value, _, _ in mark_indentation(tokenize(source))])
+    buffer, buffer_bytes = retained(lambda: lex(source))
+    tokens = len(buffer)
+    del tuples
+    statements, tree_bytes = retained(lambda: compiler.parse_instructions(buffer))
+    _, dict_bytes = retained(lambda: as_dicts(statements))
+    tracemalloc.stop()
+    count = count_statements(statements)
+    # The dict layout keeps the expression trees and replaces each statement node with a dict
+    statement_bytes = sum(sys.getsizeof(node) for node in _walk(statements))
+
+    print(f"{tokens:,} tokens, {count:,} statements, {len(source):,} bytes of source")
+    print(f"tokens as (kind, value) tuples: {tuple_bytes / tokens:7.1f} bytes/token  "
+          f"({tokens / tuple_seconds:,.0f} tokens/sec)")
+    print(f"tokens in a TokenBuffer:        {buffer_bytes / tokens:7.1f} bytes/token  "
+          f"({tokens / buffer_seconds:,.0f} tokens/sec)")
+    print(f"statements as dicts:            {(tree_bytes - statement_bytes + dict_bytes) / count:7.1f} bytes/statement")
+    print(f"statements as slotted nodes:    {tree_bytes / count:7.1f} bytes/statement")
+    return 0
+
+
+def _walk(statements):
+    for statement in statements:
+        yield statement
+        if isinstance(statement, (If, While)):
+            yield from _walk(statement.body)
+        if isinstance(statement, If):
+            yield from _walk(statement.orelse)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Check that one warm compiler keeps flat latency over many calls and is safe to share between threads.
+
+Run from the repository root: python -m benchmarks.bench_reentrant
+"""
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from two_pass_comp import TwoPassCompiler
+
+PROGRAMS = [
+    "x = 9\n",
+    "x = 10 + 7\ny = x * 2\n",
+    "x = 9\nif (x > 7)\n    y = 12\n",
+    "a = 1\nb = (a + 2) * 3\nc = b / 4 - a\n",
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1_000_000)
+    parser.add_argument('--window', type=int, default=10_000, help='calls per latency sample')
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    compiler = TwoPassCompiler()
+    expected = [compiler.compile(program) for program in PROGRAMS]
+
+    # Every window records the mean latency of its calls
+    windows = []
+    perf_counter = time.perf_counter
+    for start in range(0, args.calls, args.window):
+        count = min(args.window, args.calls - start)
+        began = perf_counter()
+        for call in range(count):
+            compiler.compile(PROGRAMS[call & 3])
+        windows.append((perf_counter() - began) / count)
+    first, last = windows[0], windows[-1]
+    print(f"{args.calls:,} calls on one instance")
+    print(f"  first window: {first * 1e6:8.2f} us/call")
+    print(f"  last window:  {last * 1e6:8.2f} us/call  ({last / first:.2f}x the first)")
+    print(f"  median:       {statistics.median(windows) * 1e6:8.2f} us/call")
+
+    jobs = [PROGRAMS[n % len(PROGRAMS)] for n in range(10_000)]
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(compiler.compile, jobs))
+    mismatches = sum(result != expected[n % len(PROGRAMS)] for n, result in enumerate(results))
+    print(f"{len(jobs):,} calls across {args.threads} threads: {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
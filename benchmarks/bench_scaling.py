@@ -0,0 +1,324 @@
+"""Measure how each compiler phase scales with program size, and catch regressions against a saved run.
+
+Programs come from a seeded generator with a configurable number of
+lines, expression depth or length, and 'if' density, so a run can be
+repeated exactly. For both two_pass.py and two_pass_comp.py, 'run' times each
+phase separately and records its peak memory through tracemalloc. For
+two_pass.py the phases are first_pass() and second_pass(), since it
+parses during second_pass(). For two_pass_comp.py they are the lexer
+alone ('lex', since its first_pass() also parses), parse_instructions()
+and second_pass(). Each phase is measured in two sweeps. The first goes
+over program sizes at a fixed depth. The second goes over the length of
+flat expressions at a fixed number of lines, since a cost that is
+quadratic in the length of one expression grows only linearly with the
+number of lines. The results are written as JSON.
+
+'compare' checks a new run against a baseline. It flags any phase whose
+time grew by more than the tolerance. It also flags, within the new run
+alone, any phase whose time grows faster than the source in either
+sweep, such as a loop that pops from the front of a list, because that
+only shows up at sizes a baseline may not cover.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_scaling run --sizes 10,1000,100000 --lengths 100,10000 -o base.json
+    python -m benchmarks.bench_scaling compare base.json new.json
+    python -m benchmarks.bench_scaling generate 10000000 -o big.src
+"""
+import argparse
+import gc
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import two_pass
+import two_pass_comp
+
+MODULES = {'two_pass': two_pass, 'two_pass_comp': two_pass_comp}
+PHASES = ('first_pass', 'lex', 'parse_instructions', 'second_pass')
+# Exponent of time against source size above which a phase counts as superlinear
+SUPERLINEAR_EXPONENT = 1.3
+# Phases faster than this are too noisy to judge for regressions or scaling
+MIN_SECONDS = 0.05
+
+
+def generate_lines(lines, depth=3, if_density=0.1, seed=0, terms=None):
+    """Yield the lines of a program about lines long.
+
+    Expressions nest up to depth operators deep or, with terms set, are a
+    flat chain of that many operands. if_density of the statements are
+    guarded by an 'if' with a single comparison, which both compilers
+    accept.
+    """
+    rng = random.Random(seed)
+    names = [f"v{n}" for n in range(32)]
+    produced = 0
+    for name in names[:min(len(names), lines)]:
+        yield f"{name} = {rng.randint(0, 99)}"
+        produced += 1
+
+    def operand():
+        return rng.choice(names) if rng.random() < 0.6 else str(rng.randint(1, 99))
+
+    def expression(level):
+        if terms:
+            return " ".join(f"{operand()} {rng.choice('+-*/')}" for _ in range(terms - 1)) + f" {operand()}"
+        if level == 0 or rng.random() < 0.25:
+            return operand()
+        text = f"{expression(level - 1)} {rng.choice('+-*/')} {expression(level - 1)}"
+        return f"({text})" if rng.random() < 0.5 else text
+
+    while produced < lines:
+        if lines - produced >= 2 and rng.random() < if_density:
+            yield f"if ({rng.choice(names)} {rng.choice(('>', '<', '=='))} {rng.randint(0, 99)})"
+            yield f"    {rng.choice(names)} = {expression(depth)}"
+            produced += 2
+        else:
+            yield f"{rng.choice(names)} = {expression(depth)}"
+            produced += 1
+
+
+def generate_program(lines, depth=3, if_density=0.1, seed=0, terms=None):
+    return "\n".join(generate_lines(lines, depth, if_density, seed, terms)) + "\n"
+
+
+def _phases(module, source):
+    """Return [(phase, callable)], each callable running one phase on the previous phase's output."""
+    compiler = module.TwoPassCompiler()
+    if module is two_pass:
+        def first_pass():
+            compiler.first_pass(source)
+
+        def second_pass():
+            compiler.second_pass(compiler.instructions)
+        return [('first_pass', first_pass), ('second_pass', second_pass)]
+
+    state = {}
+
+    def lex():
+        # first_pass() would parse as well, so the lexer is timed on its own
+        state['tokens'] = compiler.lexer(source, compiler.keywords)
+
+    def parse_instructions():
+        state['statements'] = compiler.parse_instructions(state['tokens'])
+
+    def second_pass():
+        compiler.second_pass(state['statements'])
+    return [('lex', lex), ('parse_instructions', parse_instructions), ('second_pass', second_pass)]
+
+
+def _peak_bytes(function):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(module_name, source, repeat, memory=True):
+    """Return {phase: {'seconds': best time, 'peak_bytes': peak allocation or None}} for one module."""
+    results = {}
+    phases = _phases(MODULES[module_name], source)
+    for phase, function in phases:
+        best = float('inf')
+        # As in timeit, collections would otherwise land on whichever run crosses a threshold
+        gc.disable()
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+        results[phase] = {'seconds': best, 'peak_bytes': None}
+    if memory:
+        # Traced separately, since tracemalloc slows the timed runs down
+        for phase, function in phases:
+            results[phase]['peak_bytes'] = _peak_bytes(function)
+    return results
+
+
+def run(args):
+    records = []
+    # (sweep, lines, terms) of every program measured: sizes at --depth, then lengths at --length-lines
+    programs = ([('lines', lines, None) for lines in args.sizes]
+                + [('length', args.length_lines, terms) for terms in args.lengths])
+    for sweep, lines, terms in programs:
+        source = generate_program(lines, args.depth, args.if_density, args.seed, terms)
+        # Small programs are timed over more repeats, as their timings are noisier
+        repeat = args.repeat if lines >= 10_000 else args.repeat * 3
+        for module_name in args.modules:
+            for phase, result in measure(module_name, source, repeat, not args.no_memory).items():
+                seconds = result['seconds']
+                records.append({
+                    'module': module_name, 'phase': phase, 'sweep': sweep, 'lines': lines, 'terms': terms,
+                    'chars': len(source), 'seconds': seconds,
+                    'lines_per_second': lines / seconds if seconds else None,
+                    'peak_bytes': result['peak_bytes'],
+                })
+                peak = result['peak_bytes']
+                print(f"{module_name:<14} {phase:<19} {_size(records[-1]):>14} {seconds * 1000:12.3f} ms "
+                      f"{len(source) / seconds if seconds else 0:>14,.0f} chars/s"
+                      + (f" {peak / 2 ** 20:10.2f} MiB peak" if peak is not None else ""),
+                      file=sys.stderr)
+    report = {
+        'generator': {'depth': args.depth, 'length_lines': args.length_lines, 'if_density': args.if_density,
+                      'seed': args.seed},
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': records,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+def _by_key(report):
+    return {(record['module'], record['phase'], record['sweep'], record['lines'], record['terms'] or 0): record
+            for record in report['results']}
+
+
+def _size(record):
+    """Describe where in its sweep a record was measured."""
+    return f"{record['terms']:,} terms" if record['sweep'] == 'length' else f"{record['lines']:,} lines"
+
+
+def superlinear(report, exponent=SUPERLINEAR_EXPONENT):
+    """Yield (module, phase, smallest program, largest program, exponent) wherever time grows faster than the source.
+
+    Within each sweep, the exponent is the least-squares slope of log time
+    against log source length, over every program slow enough to time
+    reliably. Longer expressions therefore count as larger programs too,
+    and one noisy timing cannot flag a phase on its own.
+    """
+    series = {}
+    for record in report['results']:
+        if record['seconds'] >= MIN_SECONDS:
+            series.setdefault((record['module'], record['phase'], record['sweep']), []).append(record)
+    for (module, phase, _), records in sorted(series.items()):
+        records.sort(key=lambda record: record['chars'])
+        if len(records) < 2 or records[-1]['chars'] <= records[0]['chars']:
+            continue
+        xs = [math.log(record['chars']) for record in records]
+        ys = [math.log(record['seconds']) for record in records]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        growth = (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+                  / sum((x - mean_x) ** 2 for x in xs))
+        if growth > exponent:
+            yield module, phase, _size(records[0]), _size(records[-1]), growth
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    if baseline.get('generator') != current.get('generator'):
+        print(f"warning: generator settings differ: {baseline.get('generator')} vs {current.get('generator')}",
+              file=sys.stderr)
+
+    regressions = 0
+    before = _by_key(baseline)
+    for key, record in sorted(_by_key(current).items()):
+        old = before.get(key)
+        if old is None:
+            continue
+        module, phase = key[:2]
+        change = record['seconds'] / old['seconds'] - 1 if old['seconds'] else 0.0
+        memory = ""
+        if old.get('peak_bytes') and record.get('peak_bytes'):
+            memory_change = record['peak_bytes'] / old['peak_bytes'] - 1
+            memory = f"  memory {memory_change:+7.1%}"
+            if memory_change > args.tolerance:
+                memory += "  REGRESSION"
+                regressions += 1
+        # Timings of tiny phases are mostly noise, so only larger ones can regress
+        flag = "  REGRESSION" if change > args.tolerance and record['seconds'] >= MIN_SECONDS else ""
+        regressions += bool(flag)
+        print(f"{module:<14} {phase:<19} {_size(record):>14}  time {change:+7.1%}{flag}{memory}")
+
+    for module, phase, small, large, growth in superlinear(current, args.exponent):
+        print(f"{module:<14} {phase:<19} grows as size^{growth:.2f} from {small} to {large}  SUPERLINEAR")
+        regressions += 1
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def generate(args):
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for line in generate_lines(args.lines, args.depth, args.if_density, args.seed, args.terms):
+            out.write(line + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def generator_options(command):
+        command.add_argument('--depth', type=int, default=3, help='maximum expression depth (default: 3)')
+        command.add_argument('--if-density', type=float, default=0.1,
+                             help="fraction of statements guarded by an 'if' (default: 0.1)")
+        command.add_argument('--seed', type=int, default=0)
+
+    run_command = commands.add_parser('run', help='time every phase at each size and write JSON')
+    run_command.add_argument('--sizes', default='10,100,1000,10000,100000',
+                             type=lambda text: [int(size) for size in text.split(',')],
+                             help='comma-separated program sizes in lines')
+    run_command.add_argument('--lengths', default='100,1000,10000,30000',
+                             type=lambda text: [int(terms) for terms in text.split(',')],
+                             help='comma-separated flat expression lengths, in operands, to sweep at --length-lines lines')
+    run_command.add_argument('--length-lines', type=int, default=40,
+                             help='program size of the length sweep, of which the first 32 lines '
+                                  'initialize variables (default: 40)')
+    run_command.add_argument('--modules', default=','.join(MODULES),
+                             type=lambda text: text.split(','), help='modules to measure')
+    run_command.add_argument('--repeat', type=int, default=3, help='timed runs per phase; the best is kept')
+    run_command.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory runs')
+    run_command.add_argument('-o', '--output', help='write the JSON here instead of stdout')
+    generator_options(run_command)
+
+    compare_command = commands.add_parser('compare', help='compare a run against a baseline; exits 1 on regression')
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('current')
+    compare_command.add_argument('--tolerance', type=float, default=0.25,
+                                 help='allowed slowdown or memory growth as a fraction (default: 0.25)')
+    compare_command.add_argument('--exponent', type=float, default=SUPERLINEAR_EXPONENT,
+                                 help=f'scaling exponent counted as superlinear (default: {SUPERLINEAR_EXPONENT})')
+
+    generate_command = commands.add_parser('generate', help='write a generated program')
+    generate_command.add_argument('lines', type=int)
+    generate_command.add_argument('-o', '--output', help='write here instead of stdout')
+    generate_command.add_argument('--terms', type=int, help='make every expression a flat chain of this many operands')
+    generator_options(generate_command)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        unknown = set(args.modules) - set(MODULES)
+        if unknown:
+            parser.error(f"unknown module(s): {', '.join(sorted(unknown))}")
+        return run(args)
+    if args.command == 'compare':
+        return compare(args)
+    return generate(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Count what SSA value numbering (-O3) removes on a corpus of generated programs, against -O2.
+
+For each program the static instruction count and the VM steps of one
+run are compared, and the instructions value numbering eliminated are
+listed by kind: redundant loads, arithmetic and constants, arithmetic
+folded to a constant, and dead code and stores left behind.
+
+Run from the repository root: python -m benchmarks.bench_ssa
+"""
+import argparse
+import random
+import sys
+from collections import Counter
+
+from benchmarks import bench_backends, bench_loops
+from optimizer import instruction_count
+from two_pass_comp import TwoPassCompiler
+from vm import VirtualMachine
+
+
+def generate_redundant(statements, seed=0):
+    """Return a program that recomputes the same subexpressions across statements, ifs (some with empty arms) and loops."""
+    rng = random.Random(seed)
+    names = [f"r{n}" for n in range(8)]
+    lines = [f"{name} = {rng.randint(1, 9)}" for name in names]
+    while len(lines) < statements:
+        a, b, c = rng.sample(names, 3)
+        k = rng.randint(1, 9)
+        shared = f"({a} + {k}) * {b}"
+        kind = rng.random()
+        if kind < 0.15:
+            lines += [f"if ({a} > {b})",
+                      f"    {c} = {shared} - {b}",
+                      "else",
+                      f"    {c} = {shared} + {a}",
+                      f"{rng.choice(names)} = {shared} + {c}"]
+        elif kind < 0.2:
+            lines += ["i = 0",
+                      "while (i < 4)",
+                      f"    {c} = {c} + {shared} + i",
+                      "    i = i + 1",
+                      f"{a} = {c} / ({shared} + 1)"]
+        elif kind < 0.25:
+            # Arms left empty, which branch straight to the join
+            lines += [f"if ({a} > {b})",
+                      "else",
+                      f"    {c} = {shared}",
+                      f"if ({c} < {k})",
+                      f"{a} = {shared} + {k}"]
+        else:
+            lines += [f"{c} = {shared} + {k}",
+                      f"{rng.choice(names)} = {shared} - {c}"]
+    return "\n".join(lines) + "\n"
+
+
+def corpus(size):
+    return {
+        'backends': bench_backends.generate_program(size),
+        'backends-if': bench_backends.generate_program(size, seed=1, if_density=0.5),
+        'loops': bench_loops.generate_program(max(size // 100, 1), 50),
+        'redundant': generate_redundant(size),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--statements', type=int, default=2000)
+    parser.add_argument('-r', '--registers', type=int, metavar='N',
+                        help='allocate onto N physical registers, as the compiler CLI does')
+    args = parser.parse_args(argv)
+
+    total = Counter()
+    print(f"{'program':<12} {'-O2 static':>11} {'-O3 static':>11} {'change':>8} "
+          f"{'-O2 steps':>11} {'-O3 steps':>11} {'change':>8}  eliminated")
+    for name, source in corpus(args.statements).items():
+        events = {}
+        results = {}
+        static = {}
+        steps = {}
+        for level in (2, 3):
+            compiler = TwoPassCompiler(num_registers=args.registers, optimization_level=level,
+                                       trace=lambda event, payload: events.__setitem__(event, payload))
+            assembly = compiler.compile(source)
+            machine = VirtualMachine(assembly)
+            results[level] = machine.run()
+            static[level] = instruction_count(assembly.splitlines())
+            steps[level] = machine.steps
+        if results[2] != results[3]:
+            print(f"{name}: -O2 and -O3 disagree", file=sys.stderr)
+            return 1
+        eliminated = events['ssa'].eliminated
+        total.update(eliminated)
+        print(f"{name:<12} {static[2]:>11,} {static[3]:>11,} {(static[3] - static[2]) / static[2]:>+8.1%} "
+              f"{steps[2]:>11,} {steps[3]:>11,} {(steps[3] - steps[2]) / steps[2]:>+8.1%}  "
+              + ", ".join(f"{count} {kind}" for kind, count in sorted(eliminated.items())))
+    print("total eliminated: " + ", ".join(f"{count} {kind}" for kind, count in sorted(total.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
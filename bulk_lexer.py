@@ -0,0 +1,217 @@
+try:
+    import numpy as np
+except ImportError:  # The bulk lexer is optional; two_pass_comp.lex() needs nothing beyond the standard library
+    np = None
+
+from token_buffer import DEDENT, INDENT, KEYWORD, KIND_CODES, NEWLINE, TokenBuffer
+from two_pass_comp import KEYWORDS
+from two_pass_comp import lex as regex_lex
+
+# Byte classes. Every byte not listed is OTHER, which the regex lexer reports as unexpected.
+OTHER, SPACE, NEWLINE_BYTE, DIGIT, LETTER, EQUALS, GREATER, OPERATOR = range(8)
+# Source bytes classified at a time, which bounds the memory of the per-byte arrays
+CHUNK_BYTES = 1 << 20
+
+
+def _tables():
+    classes = np.full(256, OTHER, dtype=np.uint8)
+    kinds = np.zeros(256, dtype=np.uint8)
+    for byte in b' \t\r':
+        classes[byte] = SPACE
+    classes[ord('\n')] = NEWLINE_BYTE
+    kinds[ord('\n')] = NEWLINE
+    for byte in b'0123456789':
+        classes[byte] = DIGIT
+        kinds[byte] = KIND_CODES['NUMBER']
+    for byte in b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_':
+        classes[byte] = LETTER
+        kinds[byte] = KIND_CODES['ID']
+    classes[ord('=')] = EQUALS
+    kinds[ord('=')] = KIND_CODES['ASSIGN']
+    classes[ord('>')] = GREATER
+    kinds[ord('>')] = KIND_CODES['GT']
+    for char, kind in (('+', 'PLUS'), ('-', 'MINUS'), ('*', 'MUL'), ('/', 'DIV'), ('<', 'LT'),
+                       ('(', 'LPAREN'), (')', 'RPAREN')):
+        classes[ord(char)] = OPERATOR
+        kinds[ord(char)] = KIND_CODES[kind]
+    return classes, kinds
+
+
+_CLASSES, _KINDS = _tables() if np is not None else (None, None)
+
+
+def available():
+    return np is not None
+
+
+def _previous(values, fill):
+    """Return values shifted right by one, so element i holds values[i - 1]."""
+    shifted = np.empty_like(values)
+    if len(values):
+        shifted[0] = fill
+        shifted[1:] = values[:-1]
+    return shifted
+
+
+def lex(code, keywords=KEYWORDS, line_num=1):
+    """Lex code into a TokenBuffer with NumPy, classifying bytes in bulk instead of matching one token at a time.
+
+    The tokens and errors are exactly those of two_pass_comp.lex(), which
+    this falls back to for source that is not ASCII. Each byte is classified
+    through a lookup table, token starts are found where the class changes,
+    and only identifier spans are compared against the keywords. The source
+    is classified CHUNK_BYTES at a time, split after a newline since no token
+    spans one, so the per-byte arrays stay small however large the source;
+    only the token arrays grow with it. Only the lines whose indentation
+    changes are walked in Python. Raises ImportError when NumPy is not
+    installed.
+    """
+    if np is None:
+        raise ImportError("the bulk lexer needs numpy")
+    if not code.isascii():
+        return regex_lex(code, keywords, line_num)
+    tokens = TokenBuffer(code, line_num)
+    if not code:
+        return tokens
+    offsets = np.dtype(f'=u{tokens.starts.itemsize}')
+    patterns = [np.frombuffer(keyword.encode('ascii'), dtype=np.uint8)
+                for keyword in keywords if keyword.isascii() and keyword]
+    kind_chunks, start_chunks, end_chunks = [], [], []
+    mismatch = None
+    for chunk_start, chunk_end in _chunks(code):
+        kinds, token_starts, token_ends, limit = _lex_chunk(code[chunk_start:chunk_end].encode('ascii'), patterns)
+        kind_chunks.append(kinds)
+        start_chunks.append((token_starts + chunk_start).astype(offsets))
+        end_chunks.append((token_ends + chunk_start).astype(offsets))
+        if limit is not None:
+            # Nothing after an unexpected byte is lexed, so only indentation errors before it can win
+            mismatch = chunk_start + limit
+            break
+    kinds, token_starts, token_ends = (np.concatenate(chunks) for chunks in (kind_chunks, start_chunks, end_chunks))
+    del kind_chunks, start_chunks, end_chunks
+
+    kinds, token_starts, token_ends, trailing = _mark_indentation(kinds, token_starts, token_ends, line_num)
+    if mismatch is not None:
+        line = line_num + code.count('\n', 0, mismatch)
+        raise RuntimeError(f'{code[mismatch]!r} unexpected on line {line}')
+    tokens.kinds.frombytes(kinds)
+    tokens.starts.frombytes(token_starts.view(np.uint8))
+    tokens.ends.frombytes(token_ends.view(np.uint8))
+    if trailing and tokens.kinds[-1] != NEWLINE:
+        # The source ended mid-line; end that line before closing its blocks
+        tokens.append(NEWLINE, len(code), len(code))
+    for _ in range(trailing):
+        tokens.append(DEDENT, len(code), len(code))
+    return tokens
+
+
+def _chunks(code):
+    """Yield (start, end) spans covering code, each ending just after a newline unless it ends the source.
+
+    A span is CHUNK_BYTES long at most, except where one line is longer.
+    """
+    start = 0
+    size = len(code)
+    while start < size:
+        if size - start <= CHUNK_BYTES:
+            end = size
+        else:
+            end = code.rfind('\n', start, start + CHUNK_BYTES) + 1
+            if end <= start:
+                end = code.find('\n', start + CHUNK_BYTES) + 1 or size
+        yield start, end
+        start = end
+
+
+def _lex_chunk(chunk, patterns):
+    """Return the (kinds, starts, ends) of the tokens in a chunk of ASCII bytes, before indentation is marked.
+
+    The fourth value is the offset of the first unexpected byte, before
+    which the tokens stop, or None if there is none.
+    """
+    data = np.frombuffer(chunk, dtype=np.uint8)
+    classes = _CLASSES[data]
+    size = len(data)
+    index = np.arange(size, dtype=np.int32 if size < 2 ** 31 else np.intp)
+
+    # A digit belongs to an identifier when a letter comes before it in the
+    # same run of word characters; otherwise it is part of a number.
+    word = (classes == DIGIT) | (classes == LETTER)
+    last_letter = np.maximum.accumulate(np.where(classes == LETTER, index, -1))
+    last_break = np.maximum.accumulate(np.where(word, -1, index))
+    category = classes.copy()
+    category[(classes == DIGIT) & (last_letter > last_break)] = LETTER
+    del last_letter, last_break
+    starts = word & (category != _previous(category, OTHER))
+
+    starts |= (classes == NEWLINE_BYTE) | (classes == OPERATOR) | (classes == GREATER)
+    # '>=' takes the '=' after a '>'; the '=' left over pair up into '==' from the left of each run
+    equals = (classes == EQUALS) & (_previous(classes, OTHER) != GREATER)
+    run_start = equals & ~_previous(equals, False)
+    offset = index - np.maximum.accumulate(np.where(run_start, index, 0))
+    starts |= equals & (offset % 2 == 0)
+    del index, offset
+
+    mismatches = np.flatnonzero(classes == OTHER)
+    limit = int(mismatches[0]) if len(mismatches) else None
+    token_starts = np.flatnonzero(starts[:limit])
+    gaps = np.flatnonzero((classes == SPACE) | (classes == OTHER))
+    gaps = np.append(gaps, size)
+    token_ends = np.minimum(np.append(token_starts[1:], size), gaps[np.searchsorted(gaps, token_starts)])
+    first_bytes = data[token_starts]
+    kinds = _KINDS[first_bytes]
+    double = token_ends - token_starts == 2
+    kinds[double & (first_bytes == ord('='))] = KIND_CODES['EQ']
+    kinds[double & (first_bytes == ord('>'))] = KIND_CODES['GEQ']
+
+    identifiers = kinds == KIND_CODES['ID']
+    lengths = token_ends - token_starts
+    for pattern in patterns:
+        candidates = np.flatnonzero(identifiers & (lengths == len(pattern)))
+        if len(candidates):
+            spans = data[token_starts[candidates, None] + np.arange(len(pattern))]
+            kinds[candidates[(spans == pattern).all(axis=1)]] = KEYWORD
+    return kinds, token_starts, token_ends, limit
+
+
+def _mark_indentation(kinds, starts, ends, line_num):
+    """Insert INDENT and DEDENT tokens as two_pass_comp.lex() does.
+
+    Returns the new (kinds, starts, ends) and the number of DEDENTs still
+    owed at the end of the source.
+    """
+    newlines = kinds == NEWLINE
+    first = ~newlines & _previous(newlines, True)
+    lines = np.flatnonzero(first)
+    if not len(lines):
+        return kinds, starts, ends, 0
+    # The line of a token starts where the NEWLINE before it ends, or at 0 for the first line
+    line_starts = np.where(lines > 0, ends[np.maximum(lines - 1, 0)], 0)
+    columns = starts[lines] - line_starts + 1
+    # Each line's column stays on top of the stack, so only lines that change it need a look
+    changes = np.flatnonzero(columns[1:] != columns[:-1]) + 1
+    levels = [int(columns[0])]
+    positions = []
+    inserted = []
+    for change in changes.tolist():
+        col = int(columns[change])
+        token = int(lines[change])
+        if col > levels[-1]:
+            levels.append(col)
+            positions.append(token)
+            inserted.append(INDENT)
+        else:
+            while len(levels) > 1 and col < levels[-1]:
+                levels.pop()
+                positions.append(token)
+                inserted.append(DEDENT)
+            if col != levels[-1]:
+                line = line_num + int(np.count_nonzero(newlines[:token + 1]))
+                raise RuntimeError(f'Inconsistent indentation on line {line}')
+    if positions:
+        positions = np.array(positions, dtype=np.intp)
+        at = starts[positions]
+        kinds = np.insert(kinds, positions, inserted)
+        starts = np.insert(starts, positions, at)
+        ends = np.insert(ends, positions, at)
+    return kinds, starts, ends, len(levels) - 1
@@ -0,0 +1,286 @@
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+
+from vm import Program, assemble
+
+MAGIC = b'TPBC'
+VERSION = 1
+
+# magic, version, flags, instructions, registers, stack slots, symbols, labels, string bytes
+HEADER = struct.Struct('<4sHH6I')
+
+# One byte per opcode; the numbering is part of the format, so only append.
+# LOAD_WIDE loads an immediate too large for an operand; its value is
+# stored in the symbol table as decimal text.
+OPCODES = ('LOAD_IMM', 'LOAD', 'STORE', 'ADD', 'SUB', 'MUL', 'DIV',
+           'CMP_GT', 'CMP_LT', 'CMP_EQ', 'JUMP', 'JUMP_IF_FALSE',
+           'SPILL', 'RELOAD', 'LOAD_WIDE', 'MOVE')
+OPCODE_NUMBERS = {opcode: number for number, opcode in enumerate(OPCODES)}
+
+# Opcode -> which operand (0 or 1) names a symbol or a label; the others are plain integers
+SYMBOL_OPERANDS = {'LOAD': 1, 'STORE': 0, 'LOAD_WIDE': 1}
+LABEL_OPERANDS = {'JUMP': 0, 'JUMP_IF_FALSE': 0}
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def _padded(size):
+    return (size + 3) & ~3
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode(assembly):
+    """Encode assembly text (or a Program from vm.assemble()) into bytecode.
+
+    The layout after the header is: operand a and operand b of every
+    instruction as int32 arrays, the end offset of each symbol in the string
+    table, the label table as (symbol, instruction) pairs, one opcode byte per
+    instruction and the UTF-8 string table. Every section starts 4-byte
+    aligned so that it can be viewed in place. Jumps refer to an entry in the
+    label table rather than to an instruction, which keeps label names intact
+    for disassembly. Comments are not kept.
+    """
+    program = assembly if isinstance(assembly, Program) else assemble(assembly)
+    symbols = {}
+    label_index = {name: index for index, name in enumerate(program.labels)}
+
+    def intern(name):
+        if name not in symbols:
+            symbols[name] = len(symbols)
+        return symbols[name]
+
+    label_table = array('I')
+    for name, target in program.labels.items():
+        label_table.extend((intern(name), target))
+
+    opcodes = array('B')
+    operands_a = array('i')
+    operands_b = array('i')
+    for line, (opcode, a, b) in zip(program.lines, program.code):
+        if opcode == 'LOAD_IMM' and not INT32_MIN <= b <= INT32_MAX:
+            opcode, b = 'LOAD_WIDE', str(b)
+        if opcode in SYMBOL_OPERANDS:
+            if SYMBOL_OPERANDS[opcode]:
+                b = intern(b)
+            else:
+                a = intern(a)
+        elif opcode in LABEL_OPERANDS:
+            # assemble() resolved the label; recover the name this line used
+            a = label_index[line.split(None, 1)[1].strip()]
+        opcodes.append(OPCODE_NUMBERS[opcode])
+        operands_a.append(a or 0)
+        operands_b.append(b or 0)
+
+    symbol_ends = array('I')
+    strings = bytearray()
+    for name in symbols:
+        strings += name.encode('utf-8')
+        symbol_ends.append(len(strings))
+
+    header = HEADER.pack(MAGIC, VERSION, 0, len(opcodes), program.num_registers, program.num_slots,
+                         len(symbols), len(program.labels), len(strings))
+    opcode_bytes = opcodes.tobytes()
+    return b''.join((
+        header,
+        _little_endian(operands_a),
+        _little_endian(operands_b),
+        _little_endian(symbol_ends),
+        _little_endian(label_table),
+        opcode_bytes, bytes(_padded(len(opcode_bytes)) - len(opcode_bytes)),
+        bytes(strings),
+    ))
+
+
+def _view(buffer, offset, count, typecode):
+    """Return count items of typecode at offset, without copying on little-endian machines."""
+    view = buffer[offset:offset + count * 4].cast(typecode)
+    if sys.byteorder == 'big':
+        view = array(typecode, view)
+        view.byteswap()
+    return view
+
+
+class Bytecode:
+    """A decoded bytecode image whose instruction arrays are views into the underlying buffer."""
+
+    def __init__(self, buffer, mapping=None):
+        buffer = memoryview(buffer).cast('B')
+        if len(buffer) < HEADER.size:
+            raise ValueError("Not a bytecode file: too short")
+        (magic, version, _, count, self.num_registers, self.num_slots,
+         num_symbols, num_labels, string_size) = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a bytecode file: bad magic number")
+        if version != VERSION:
+            raise ValueError(f"Unsupported bytecode version {version} (expected {VERSION})")
+        offset = HEADER.size
+        sections = []
+        for items, typecode in ((count, 'i'), (count, 'i'), (num_symbols, 'I'), (num_labels * 2, 'I')):
+            sections.append((offset, items, typecode))
+            offset += items * 4
+        opcode_offset = offset
+        string_offset = opcode_offset + _padded(count)
+        if len(buffer) < string_offset + string_size:
+            raise ValueError("Truncated bytecode file")
+
+        self._buffer = buffer
+        self._mapping = mapping
+        self.operands_a, self.operands_b, symbol_ends, label_table = (
+            _view(buffer, *section) for section in sections)
+        self.opcodes = buffer[opcode_offset:opcode_offset + count]
+        strings = buffer[string_offset:string_offset + string_size]
+        self.symbols = []
+        start = 0
+        for end in symbol_ends:
+            self.symbols.append(str(strings[start:end], 'utf-8'))
+            start = end
+        self.labels = [(self.symbols[label_table[index]], label_table[index + 1])
+                       for index in range(0, len(label_table), 2)]
+        for view in (symbol_ends, label_table, strings):
+            if isinstance(view, memoryview):
+                view.release()
+        for opcode in set(self.opcodes):
+            if opcode >= len(OPCODES):
+                raise ValueError(f"Unknown opcode {opcode} in bytecode")
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def close(self):
+        """Release the views and, for a loaded file, its memory mapping."""
+        for view in (self.operands_a, self.operands_b, self.opcodes, self._buffer):
+            if isinstance(view, memoryview):
+                view.release()
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def instructions(self):
+        """Yield (opcode, a, b) with symbols as names and jump targets as label names."""
+        symbols = self.symbols
+        labels = self.labels
+        for number, a, b in zip(self.opcodes, self.operands_a, self.operands_b):
+            opcode = OPCODES[number]
+            if opcode in SYMBOL_OPERANDS:
+                if SYMBOL_OPERANDS[opcode]:
+                    b = symbols[b]
+                else:
+                    a = symbols[a]
+            elif opcode in LABEL_OPERANDS:
+                a = labels[a][0]
+            yield opcode, a, b
+
+    def lines(self):
+        """Yield the program as assembly text lines, labels included."""
+        labels_at = {}
+        for name, target in self.labels:
+            labels_at.setdefault(target, []).append(name)
+        for pc, instruction in enumerate(self.instructions()):
+            for name in labels_at.get(pc, ()):
+                yield f"{name}:"
+            yield _format(*instruction)
+        # Labels referenced but never defined end up here, which keeps jumps to them halting
+        for name in labels_at.get(len(self), ()):
+            yield f"{name}:"
+
+    def to_text(self):
+        return "\n".join(self.lines())
+
+    def to_program(self):
+        """Return a vm.Program, ready for a VirtualMachine."""
+        targets = dict(self.labels)
+        code = []
+        lines = []
+        for opcode, a, b in self.instructions():
+            lines.append(_format(opcode, a, b))
+            if opcode == 'LOAD_WIDE':
+                opcode, b = 'LOAD_IMM', int(b)
+            elif opcode in LABEL_OPERANDS:
+                a, b = targets[a], None
+            code.append((opcode, a, b))
+        return Program(code, lines, dict(self.labels), self.num_registers, self.num_slots)
+
+
+def _format(opcode, a, b):
+    if opcode in LABEL_OPERANDS:
+        return f"{opcode} {a}"
+    if opcode in ('LOAD_IMM', 'LOAD_WIDE'):
+        return f"LOAD R{a}, #{b}"
+    if opcode == 'LOAD':
+        return f"LOAD R{a}, {b}"
+    if opcode == 'STORE':
+        return f"STORE {a}, R{b}"
+    if opcode == 'SPILL':
+        return f"SPILL [sp+{a}], R{b}"
+    if opcode == 'RELOAD':
+        return f"RELOAD R{a}, [sp+{b}]"
+    return f"{opcode} R{a}, R{b}"
+
+
+def decode(buffer):
+    """Decode bytecode held in any buffer (bytes, bytearray, mmap, ...) without copying it."""
+    return Bytecode(buffer)
+
+
+def write(path, assembly):
+    data = encode(assembly)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def load(path):
+    """Memory-map a bytecode file; close() the result (or use it as a context manager) when done."""
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return Bytecode(mapping, mapping)
+    except BaseException:
+        mapping.close()
+        raise
+
+
+def is_bytecode(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def main(argv=None):
+    """Convert between assembly text and bytecode."""
+    parser = argparse.ArgumentParser(description='Convert between assembly text and bytecode.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    encode_parser = subparsers.add_parser('encode', help='assemble text into a bytecode file')
+    encode_parser.add_argument('assembly', help='assembly file')
+    encode_parser.add_argument('output', help='bytecode file to write')
+    decode_parser = subparsers.add_parser('decode', help='print a bytecode file as assembly text')
+    decode_parser.add_argument('bytecode', help='bytecode file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'encode':
+        with open(args.assembly, encoding='utf-8') as f:
+            text = f.read()
+        size = write(args.output, text)
+        print(f"{len(text.encode('utf-8'))} bytes of text -> {size} bytes of bytecode", file=sys.stderr)
+    else:
+        with load(args.bytecode) as bytecode:
+            sys.stdout.writelines(line + '\n' for line in bytecode.lines())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import argparse
+import sys
+
+BRANCHES = {'JUMP', 'JUMP_IF_FALSE'}
+
+
+def split_instruction(line):
+    """Split an assembly line into (opcode, operands); labels and comments give (None, [])."""
+    line = line.strip()
+    if not line or line.startswith(';') or line.endswith(':'):
+        return None, []
+    opcode, _, rest = line.partition(' ')
+    operands = [operand.strip() for operand in rest.split(',')] if rest else []
+    return opcode, operands
+
+
+class BasicBlock:
+    """A maximal run of instructions that is only entered at the top and only left at the bottom."""
+
+    __slots__ = ('number', 'start', 'end', 'label', 'successors', 'predecessors')
+
+    def __init__(self, number, start, end, label=None):
+        self.number = number
+        self.start = start  # Index of the first line, which may be its label
+        self.end = end  # One past the last line
+        self.label = label
+        self.successors = []  # Block numbers
+        self.predecessors = []
+
+    def __repr__(self):
+        return f"BasicBlock({self.number}, lines {self.start}-{self.end - 1}, label={self.label!r})"
+
+
+class ControlFlowGraph:
+    """The basic blocks of an assembly listing and the jumps between them.
+
+    A block starts at every label and after every branch. A branch to a
+    label that is never defined leaves the program, so it has no successor
+    block.
+    """
+
+    def __init__(self, lines, instructions=None):
+        self.lines = list(lines)
+        # (opcode, operands) per line, as split_instruction() returns them
+        self.instructions = instructions or [split_instruction(line) for line in self.lines]
+        labels = {}
+        leaders = {0}
+        for index, line in enumerate(self.lines):
+            opcode, _ = self.instructions[index]
+            stripped = line.strip()
+            if stripped.endswith(':') and not stripped.startswith(';'):
+                labels[stripped[:-1]] = index
+                leaders.add(index)
+            elif opcode in BRANCHES:
+                leaders.add(index + 1)
+        starts = sorted(leader for leader in leaders if leader < len(self.lines))
+        label_at = {index: name for name, index in labels.items()}
+        self.blocks = [BasicBlock(number, start, end, label_at.get(start))
+                       for number, (start, end) in enumerate(zip(starts, starts[1:] + [len(self.lines)]))]
+        block_at = {block.start: block.number for block in self.blocks}
+        self.labels = {name: block_at[index] for name, index in labels.items() if index in block_at}
+
+        for block in self.blocks:
+            last_opcode, last_operands = self.instructions[block.end - 1]
+            if last_opcode in BRANCHES and last_operands[0] in self.labels:
+                block.successors.append(self.labels[last_operands[0]])
+            if last_opcode != 'JUMP' and block.number + 1 < len(self.blocks):
+                block.successors.append(block.number + 1)
+            for successor in block.successors:
+                self.blocks[successor].predecessors.append(block.number)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def back_edges(self):
+        """Return the (tail, head) edges that close a cycle, found by depth-first search from the entry."""
+        if not self.blocks:
+            return []
+        edges = []
+        state = [0] * len(self.blocks)  # 0 unvisited, 1 on the search path, 2 finished
+        stack = [(0, iter(self.blocks[0].successors))]
+        state[0] = 1
+        while stack:
+            number, successors = stack[-1]
+            for successor in successors:
+                if state[successor] == 1:
+                    edges.append((number, successor))
+                elif state[successor] == 0:
+                    state[successor] = 1
+                    stack.append((successor, iter(self.blocks[successor].successors)))
+                    break
+            else:
+                state[number] = 2
+                stack.pop()
+        return edges
+
+    def loops(self):
+        """Return {header: set of block numbers} for the natural loop of every back edge."""
+        loops = {}
+        for tail, head in self.back_edges():
+            body = loops.setdefault(head, {head})
+            stack = [tail]
+            while stack:
+                number = stack.pop()
+                if number not in body:
+                    body.add(number)
+                    stack.extend(self.blocks[number].predecessors)
+        return loops
+
+    def instruction_count(self, numbers):
+        """Count the executable instructions in the given blocks."""
+        return sum(1 for number in numbers
+                   for index in range(self.blocks[number].start, self.blocks[number].end)
+                   if self.instructions[index][0] is not None)
+
+    def to_dot(self):
+        """Render the graph in Graphviz dot syntax, one node per block listing its instructions."""
+        back_edges = set(self.back_edges())
+        out = ['digraph cfg {', '  node [shape=box, fontname="monospace"];']
+        for block in self.blocks:
+            text = "\\l".join(line.strip().replace('"', '\\"') for line in self.lines[block.start:block.end])
+            out.append(f'  b{block.number} [label="{text}\\l"];')
+            for successor in block.successors:
+                style = ' [style=dashed]' if (block.number, successor) in back_edges else ''
+                out.append(f'  b{block.number} -> b{successor}{style};')
+        out.append('}')
+        return "\n".join(out)
+
+
+def main(argv=None):
+    """Print the basic blocks and loops of an assembly file, or its graph in dot syntax."""
+    parser = argparse.ArgumentParser(description='Show the control-flow graph of an assembly file.')
+    parser.add_argument('assembly', help="assembly file, or '-' to read stdin")
+    parser.add_argument('--dot', action='store_true', help='print Graphviz dot instead of a summary')
+    args = parser.parse_args(argv)
+    if args.assembly == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.assembly, encoding='utf-8') as f:
+            text = f.read()
+    graph = ControlFlowGraph(text.splitlines())
+    if args.dot:
+        print(graph.to_dot())
+        return 0
+    for block in graph.blocks:
+        print(f"block {block.number:<4} {block.label or '':<10} "
+              f"{graph.instruction_count([block.number]):>5} instructions -> {block.successors}")
+    for head, body in sorted(graph.loops().items()):
+        print(f"loop at block {head}: blocks {sorted(body)}, {graph.instruction_count(body)} instructions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
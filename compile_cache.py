@@ -0,0 +1,141 @@
+import hashlib
+import os
+import tempfile
+
+from two_pass_comp import TwoPassCompiler
+
+# Modules whose source determines the generated code; any change to them
+# changes the version stamp and so invalidates every cached entry.
+_COMPILER_MODULES = ('two_pass_comp.py', 'token_buffer.py', 'expressions.py', 'optimizer.py', 'loops.py',
+                     'cfg.py', 'regalloc.py', 'ssa.py')
+_compiler_version = None
+
+
+def compiler_version():
+    """Return a stamp identifying the current compiler implementation."""
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in _COMPILER_MODULES:
+            with open(os.path.join(here, name), 'rb') as f:
+                digest.update(f.read())
+        _compiler_version = digest.hexdigest()[:16]
+    return _compiler_version
+
+
+class CompileCache:
+    """Content-addressed on-disk store of compiled assembly with LRU eviction.
+
+    Entries are keyed by a hash of the source, the compiler options and the
+    compiler version, and live at <directory>/<key[:2]>/<key>.asm. Writes go
+    to a temporary file that is renamed into place, so several processes can
+    share one directory. A hit refreshes the entry's modification time, and
+    when the directory grows past max_bytes the least recently used entries
+    are deleted until it is back under low_water of max_bytes, so the scan of
+    the directory that eviction needs is paid once per batch of misses rather
+    than on every miss of a full cache.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def key(self, source, options=None):
+        digest = hashlib.sha256()
+        digest.update(compiler_version().encode())
+        digest.update(repr(sorted((options or {}).items())).encode())
+        digest.update(b'\0')
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.asm')
+
+    def get(self, key):
+        """Return the cached assembly for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                assembly = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Missing, or evicted by another process between the open and the utime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return assembly
+
+    def put(self, key, assembly):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = assembly.encode('utf-8')
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size  # Overwriting an entry frees its old size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self._size += len(data) - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def compile(self, source, **options):
+        """Return the assembly for source, compiling and storing it on a miss."""
+        key = self.key(source, options)
+        assembly = self.get(key)
+        if assembly is None:
+            assembly = TwoPassCompiler(**options).compile(source)
+            self.put(key, assembly)
+        return assembly
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.asm'):
+                    path = os.path.join(root, name)
+                    try:
+                        info = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, info.st_size, info.st_mtime
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in low_water of max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * self.low_water
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # Another process evicted it first
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        for path, _, _ in list(self._entries()):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'bytes': self._size}
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from two_pass_comp import TwoPassCompiler
+
+# Options a client may set; anything else is rejected
+OPTIONS = {'optimization_level', 'num_registers'}
+# Compilers are reentrant, so each worker keeps one per distinct set of
+# options, for the MAX_COMPILERS sets used most recently
+MAX_COMPILERS = 8
+_compilers = OrderedDict()
+
+
+def _compiler(options):
+    """Return a compiler for a request's options, raising ValueError for options the server does not accept."""
+    if not isinstance(options, dict):
+        raise ValueError("'options' must be an object")
+    unknown = set(options) - OPTIONS
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+    level = options.get('optimization_level', 0)
+    if type(level) is not int or not 0 <= level <= 3:
+        raise ValueError("'optimization_level' must be 0, 1, 2 or 3")
+    registers = options.get('num_registers')
+    if registers is not None and (type(registers) is not int or registers < 3):
+        raise ValueError("'num_registers' must be null or an integer of at least 3")
+    key = (level, registers)
+    compiler = _compilers.get(key)
+    if compiler is None:
+        compiler = _compilers[key] = TwoPassCompiler(optimization_level=level, num_registers=registers)
+        if len(_compilers) > MAX_COMPILERS:
+            _compilers.popitem(last=False)
+    else:
+        _compilers.move_to_end(key)
+    return compiler
+
+
+def compile_batch(requests):
+    """Compile a list of {id, source, options} requests and return one response dict per request."""
+    responses = []
+    for request in requests:
+        request_id = request.get('id')
+        try:
+            assembly = _compiler(request.get('options') or {}).compile(request['source'])
+        except Exception as error:  # Whatever goes wrong, only this request fails, not its whole batch
+            responses.append({'id': request_id,
+                              'error': {'type': type(error).__name__, 'message': str(error)}})
+        else:
+            responses.append({'id': request_id, 'assembly': assembly})
+    return responses
+
+
+class CompileServer:
+    """Batches compile requests and runs them on a worker pool.
+
+    Requests that arrive within batch_window seconds of the first one in a
+    batch (up to max_batch of them) are sent to the executor together, so
+    a burst of small snippets costs one round trip to a worker instead of
+    one each. Any concurrent.futures executor works; the default is a
+    process pool.
+    """
+
+    def __init__(self, executor=None, batch_window=0.002, max_batch=64, latency_samples=10_000):
+        self.executor = executor
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.latencies = deque(maxlen=latency_samples)  # Seconds from receipt to response
+        self.requests = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self._queue = None
+        self._batcher = None
+
+    async def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor()
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._run_batches())
+
+    async def stop(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, request):
+        """Queue one compile request and wait for its response dict."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((request, future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def handle(self, line):
+        """Answer one JSON-lines request; returns the response dict."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+        except ValueError as error:
+            return {'id': None, 'error': {'type': 'ProtocolError', 'message': str(error)}}
+        if request.get('op') == 'metrics':
+            return {'id': request.get('id'), 'metrics': self.metrics()}
+        if not isinstance(request.get('source'), str):
+            return {'id': request.get('id'),
+                    'error': {'type': 'ProtocolError', 'message': "'source' must be a string"}}
+        return await self.submit(request)
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            requests = [request for request, _, _ in batch]
+            try:
+                responses = await loop.run_in_executor(self.executor, compile_batch, requests)
+            except Exception as error:  # The worker itself failed, e.g. a crashed process
+                responses = [{'id': request.get('id'),
+                              'error': {'type': type(error).__name__, 'message': str(error)}}
+                             for request in requests]
+            self.batches += 1
+            now = time.perf_counter()
+            for (_, future, received), response in zip(batch, responses):
+                self.latencies.append(now - received)
+                self.requests += 1
+                if not future.done():
+                    future.set_result(response)
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'max_queue_depth': self.max_queue_depth,
+            'p50_ms': percentile(0.50),
+            'p99_ms': percentile(0.99),
+        }
+
+    async def serve_stream(self, reader, write):
+        """Answer every line from reader, passing each encoded response line to write().
+
+        Requests are handled concurrently, so responses can come back out of
+        order; clients match them up by id.
+        """
+        pending = set()
+
+        async def answer(line):
+            write((json.dumps(await self.handle(line)) + '\n').encode('utf-8'))
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(answer(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def serve_stdio(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        def write(data):
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+
+        await self.serve_stream(reader, write)
+
+    async def serve_unix(self, path):
+        async def connection(reader, writer):
+            try:
+                await self.serve_stream(reader, writer.write)
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(connection, path)
+        async with server:
+            await server.serve_forever()
+
+
+def request(path, payload):
+    """Send one request to a server on a Unix socket and return its response; for scripts and tests."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall((json.dumps(payload) + '\n').encode('utf-8'))
+        with client.makefile('r', encoding='utf-8') as responses:
+            return json.loads(responses.readline())
+
+
+async def _serve(args):
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers else None
+    server = CompileServer(executor, args.batch_window / 1000, args.max_batch)
+    await server.start()
+    try:
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
+            await server.serve_unix(args.socket)
+        else:
+            await server.serve_stdio()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    """Run the compile server on stdin/stdout or a Unix socket."""
+    parser = argparse.ArgumentParser(description='Persistent compile server speaking JSON lines.')
+    parser.add_argument('--socket', metavar='PATH', help='listen on this Unix socket instead of stdin/stdout')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--batch-window', type=float, default=2.0, metavar='MS',
+                        help='how long to wait for more requests to batch with the first (default: 2)')
+    parser.add_argument('--max-batch', type=int, default=64, help='most requests compiled in one batch')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
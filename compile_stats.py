@@ -0,0 +1,79 @@
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger('compiler')
+
+
+def log_trace(event, payload):
+    """Trace callback that forwards compiler events to the 'compiler' logger at DEBUG level."""
+    logger.debug('%s: %r', event, payload)
+
+
+class PhaseStats:
+    """Measurements for a single compiler phase."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit  # What `count` counts: tokens, statements or instructions
+        self.seconds = 0.0
+        self.count = 0
+        self.peak_bytes = None  # Only filled in when memory tracking is enabled
+
+    def __repr__(self):
+        return f"PhaseStats({self.name!r}, seconds={self.seconds:.6f}, {self.unit}={self.count})"
+
+
+class CompileStats:
+    """Per-phase wall time and token/instruction counts for one compile() call.
+
+    Pass an instance to TwoPassCompiler.compile(code, stats=...). With
+    track_memory=True each phase also records its peak allocation through
+    tracemalloc, which slows compilation down noticeably.
+    """
+
+    PHASE_UNITS = {'lexer': 'tokens', 'parser': 'statements', 'codegen': 'instructions', 'regalloc': 'spills'}
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block and attribute it to the named phase."""
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats(name, self.PHASE_UNITS.get(name, 'items'))
+        started_tracing = False
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds += time.perf_counter() - start
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                stats.peak_bytes = max(stats.peak_bytes or 0, peak)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    @property
+    def total_seconds(self):
+        return sum(stats.seconds for stats in self.phases.values())
+
+    def report(self):
+        """Return a human-readable table of the recorded phases."""
+        lines = []
+        for stats in self.phases.values():
+            line = f"{stats.name:<8} {stats.seconds * 1000:10.3f} ms {stats.count:>10} {stats.unit}"
+            if stats.peak_bytes is not None:
+                line += f"  peak {stats.peak_bytes / 1024:.1f} KiB"
+            lines.append(line)
+        lines.append(f"{'total':<8} {self.total_seconds * 1000:10.3f} ms")
+        return "\n".join(lines)
@@ -0,0 +1,215 @@
+import operator
+import sys
+
+# Binding strength of each binary operator; higher binds tighter
+PRECEDENCE = {'PLUS': 1, 'MINUS': 1, 'MUL': 2, 'DIV': 2}
+OPCODES = {'PLUS': 'ADD', 'MINUS': 'SUB', 'MUL': 'MUL', 'DIV': 'DIV'}
+COMPARISONS = {'GT', 'LT', 'EQ', 'GEQ'}
+# GEQ has no instruction of its own; code generation inverts CMP_LT for it
+COMPARE_OPCODES = {'GT': 'CMP_GT', 'LT': 'CMP_LT', 'EQ': 'CMP_EQ'}
+# Integer semantics of each operator; division rounds down
+EVALUATORS = {'PLUS': operator.add, 'MINUS': operator.sub, 'MUL': operator.mul, 'DIV': operator.floordiv}
+# Assembly comments of this form map the instructions after them to a source line and column
+LOCATION_PREFIX = '; line '
+
+
+class Num:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"Num({self.value})"
+
+
+class Var:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Var({self.name!r})"
+
+
+class BinOp:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op  # Token kind of the operator, e.g. 'PLUS'
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return f"BinOp({self.op!r}, {self.left!r}, {self.right!r})"
+
+
+class Compare:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op  # Token kind of the comparison, e.g. 'GT'
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return f"Compare({self.op!r}, {self.left!r}, {self.right!r})"
+
+
+class Assignment:
+    __slots__ = ('lhs', 'rhs', 'location')
+
+    def __init__(self, lhs, rhs, location=None):
+        self.lhs = lhs  # Variable name
+        self.rhs = rhs  # Expression tree
+        self.location = location  # (line, col) of the statement in the source, if known
+
+    def __repr__(self):
+        return f"Assignment({self.lhs!r}, {self.rhs!r})"
+
+
+class If:
+    __slots__ = ('condition', 'body', 'orelse', 'location')
+
+    def __init__(self, condition, body, orelse=None, location=None):
+        self.condition = condition  # Compare
+        self.body = body  # List of statements in the indented block
+        self.orelse = orelse if orelse is not None else []  # Statements under the 'else', if any
+        self.location = location
+
+    def __repr__(self):
+        if self.orelse:
+            return f"If({self.condition!r}, {self.body!r}, {self.orelse!r})"
+        return f"If({self.condition!r}, {self.body!r})"
+
+
+class While:
+    __slots__ = ('condition', 'body', 'location')
+
+    def __init__(self, condition, body, location=None):
+        self.condition = condition  # Compare, tested before every iteration
+        self.body = body
+        self.location = location
+
+    def __repr__(self):
+        return f"While({self.condition!r}, {self.body!r})"
+
+
+class ExpressionParser:
+    """Builds an expression tree from a list of (kind, value) tokens in a single pass.
+
+    Operators of equal precedence associate to the left. Only parentheses
+    recurse deeper, so long flat expressions do not grow the Python stack.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty expression.")
+        expr = self._expression(1)
+        if self.pos < len(self.tokens):
+            raise ValueError(f"Unexpected token in expression: {self.tokens[self.pos][0]}")
+        return expr
+
+    def _expression(self, min_precedence):
+        lhs = self._primary()
+        tokens = self.tokens
+        while self.pos < len(tokens):
+            operator = tokens[self.pos][0]
+            precedence = PRECEDENCE.get(operator)
+            if precedence is None or precedence < min_precedence:
+                break
+            self.pos += 1
+            rhs = self._expression(precedence + 1)
+            lhs = BinOp(operator, lhs, rhs)
+        return lhs
+
+    def _primary(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError("Incomplete expression.")
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == 'NUMBER':
+            return Num(int(value))
+        if kind == 'ID':
+            return Var(sys.intern(value))  # One string per distinct name, however often it is used
+        if kind == 'LPAREN':
+            expr = self._expression(1)
+            if self.pos >= len(self.tokens) or self.tokens[self.pos][0] != 'RPAREN':
+                raise ValueError("Missing ')' in expression.")
+            self.pos += 1
+            return expr
+        raise ValueError(f"Unexpected token in expression: {kind}")
+
+
+def location_comment(location):
+    """Return the assembly comment mapping the instructions after it to location, a (line, col) pair."""
+    return f"{LOCATION_PREFIX}{location[0]}:{location[1]}"
+
+
+def parse_expression(tokens):
+    """Parse a list of (kind, value) tokens into an expression tree."""
+    return ExpressionParser(tokens).parse()
+
+
+def parse_condition(tokens):
+    """Parse the tokens of an 'if' condition, optionally wrapped in parentheses, into a Compare."""
+    if len(tokens) >= 2 and tokens[0][0] == 'LPAREN' and tokens[-1][0] == 'RPAREN':
+        # Only strip the parentheses if they enclose the whole condition
+        depth = 0
+        for index, (kind, _) in enumerate(tokens):
+            depth += kind == 'LPAREN'
+            depth -= kind == 'RPAREN'
+            if depth == 0:
+                break
+        if index == len(tokens) - 1:
+            tokens = tokens[1:-1]
+
+    depth = 0
+    split = None
+    for index, (kind, _) in enumerate(tokens):
+        depth += kind == 'LPAREN'
+        depth -= kind == 'RPAREN'
+        if kind in COMPARISONS and depth == 0:
+            if split is not None:
+                raise ValueError("Only one comparison is allowed in a condition.")
+            split = index
+    if split is None or split == 0 or split == len(tokens) - 1:
+        raise ValueError("Incomplete condition in 'if' statement.")
+    return Compare(tokens[split][0], parse_expression(tokens[:split]), parse_expression(tokens[split + 1:]))
+
+
+def emit_expression(node, allocate_register, emit):
+    """Generate code for an expression tree and return the register holding its value.
+
+    Every leaf is loaded into a fresh register from allocate_register() and
+    every operator emits one two-address instruction, so the output is linear
+    in the number of operands. The walk uses an explicit stack rather than
+    recursion so that arbitrarily long expressions are fine.
+    """
+    results = []
+    stack = [(node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if isinstance(node, Num):
+            reg = allocate_register()
+            emit(f"LOAD {reg}, #{node.value}")
+            results.append(reg)
+        elif isinstance(node, Var):
+            reg = allocate_register()
+            emit(f"LOAD {reg}, {node.name}")
+            results.append(reg)
+        elif children_done:
+            right = results.pop()
+            left = results.pop()
+            emit(f"{OPCODES[node.op]} {left}, {right}")
+            results.append(left)
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return results.pop()
@@ -0,0 +1,146 @@
+import hashlib
+import io
+
+from two_pass_comp import TwoPassCompiler, split_statements
+
+
+class CompiledUnit:
+    """One top-level statement (with any block indented under it) and everything compiled from it."""
+
+    __slots__ = ('text', 'unit_id', 'tokens', 'statements', 'assembly')
+
+    def __init__(self, text, unit_id, tokens, statements, assembly):
+        self.text = text
+        self.unit_id = unit_id
+        self.tokens = tokens  # TokenBuffer of this unit
+        self.statements = statements  # Statements from parse_instructions()
+        self.assembly = assembly  # List of assembly lines
+
+
+def split_units(source, line_num=1, base=None):
+    """Split source into top-level units: a line at the base indentation plus the lines nested under it.
+
+    Units are grouped by split_statements(), exactly as compile_stream()
+    groups them, and line_num and base are passed on to it.
+    """
+    lines = io.StringIO(source, newline='\n')
+    return [''.join(unit) for _, unit in split_statements(lines, line_num, base)]
+
+
+def _indentation(text):
+    """Return the column of the first non-blank line of text, or None if there is none."""
+    for line in text.split('\n'):
+        stripped = line.lstrip(' \t\r')
+        if stripped:
+            return len(line) - len(stripped)
+    return None
+
+
+class IncrementalSession:
+    """Keeps per-statement compilation results so that an edited program only recompiles what changed.
+
+    Each top-level unit is compiled on its own, with registers numbered from
+    R0 and labels prefixed by the unit's id, which comes from its text. Editing
+    one statement therefore changes neither the tokens, the parse nor the
+    register and label names of any other, and only units with new text (or
+    a repeated text that moved among its repeats) are re-lexed and re-parsed.
+    Optimizations at optimization_level apply within a unit but not across
+    units.
+    """
+
+    def __init__(self, optimization_level=0):
+        self.optimization_level = optimization_level
+        self.compiler = TwoPassCompiler(optimization_level=optimization_level)
+        self.units = []
+        self.reused = 0  # Units kept by the last update() or edit()
+        self.recompiled = 0  # Units compiled from scratch by the last update() or edit()
+
+    def _compile_unit(self, text, unit_id):
+        session = self.compiler.compile_session(text, label_prefix=f"L{unit_id}_")
+        return CompiledUnit(text, unit_id, session.instructions, session.parsed_output,
+                            session.assembly.split('\n') if session.assembly else [])
+
+    def _rebuild(self, texts):
+        """Replace the units with units for texts, reusing those whose text and id are unchanged.
+
+        A unit's id is a digest of its text, and the n-th later unit with the
+        same digest gets the suffix _n, so the ids depend only on the program
+        and not on the edits that produced it.
+        """
+        available = {}
+        digests = {}
+        for unit in self.units:
+            available[unit.text, unit.unit_id] = unit
+            digests[unit.text] = unit.unit_id.partition('_')[0]
+        occurrences = {}
+        units = []
+        for text in texts:
+            digest = digests.get(text)
+            if digest is None:
+                digest = digests[text] = hashlib.blake2b(text.encode('utf-8'), digest_size=4).hexdigest()
+            count = occurrences.get(digest, 0)
+            occurrences[digest] = count + 1
+            unit_id = f"{digest}_{count}" if count else digest
+            unit = available.pop((text, unit_id), None)
+            if unit is not None:
+                self.reused += 1
+            else:
+                unit = self._compile_unit(text, unit_id)
+                self.recompiled += 1
+            units.append(unit)
+        self.units = units
+
+    def update(self, source):
+        """Bring the session up to date with the full source and return the program's assembly."""
+        self.reused = self.recompiled = 0
+        self._rebuild(split_units(source))
+        return self.assembly()
+
+    def edit(self, first_line, last_line, replacement):
+        """Replace source lines first_line..last_line (1-based, inclusive) and return the new assembly.
+
+        Only the units overlapping the edit, plus the one before them in case
+        the edit changes which lines nest under it, are split again, against
+        the indentation of the whole program's first line. An edit that
+        changes that line splits the rest of the program again too.
+        Pass last_line = first_line - 1 to insert before first_line.
+        """
+        self.reused = self.recompiled = 0
+        line = 1
+        first = last = None
+        for index, unit in enumerate(self.units):
+            end = line + unit.text.count('\n')
+            if first is None and end > first_line - 1:
+                first = index
+            if end > last_line or index == len(self.units) - 1:
+                last = index
+                if first is None:
+                    first = index
+                break
+            line = end
+        if first is None:
+            first = last = len(self.units)
+        first = max(first - 1, 0)
+
+        region_start = sum(unit.text.count('\n') for unit in self.units[:first]) + 1
+        lines = list(io.StringIO(''.join(unit.text for unit in self.units[first:last + 1]), newline='\n'))
+        if replacement and not replacement.endswith('\n'):
+            replacement += '\n'
+        lines[first_line - region_start:last_line - region_start + 1] = [replacement] if replacement else []
+        text = ''.join(lines)
+        base = _indentation(self.units[0].text) if self.units else None
+        if first == 0 and last + 1 < len(self.units) and _indentation(text) != base:
+            # The edit moved the program's first line, so the units after it
+            # have to be checked against the new base indentation
+            text += ''.join(unit.text for unit in self.units[last + 1:])
+            last = len(self.units) - 1
+        texts = split_units(text, region_start, base if first > 0 else None)
+        self._rebuild([unit.text for unit in self.units[:first]] + texts
+                      + [unit.text for unit in self.units[last + 1:]])
+        return self.assembly()
+
+    def source(self):
+        return ''.join(unit.text for unit in self.units)
+
+    def assembly(self):
+        return "\n".join(line for unit in self.units for line in unit.assembly)
@@ -0,0 +1,285 @@
+import itertools
+from collections import Counter
+
+from expressions import Assignment, BinOp, If, Num, Var, While
+
+# Cost in instructions of one multiplication i * c (two loads and a MUL),
+# of the LOAD that replaces it, and of the update .t = .t + step * c
+_PRODUCT_COST = 3
+_REDUCED_USE_COST = 1
+_UPDATE_COST = 4
+
+
+def assigned_variables(statements):
+    """Return the set of variables assigned anywhere in statements, nested blocks included."""
+    names = set()
+    stack = list(statements)
+    while stack:
+        statement = stack.pop()
+        if isinstance(statement, Assignment):
+            names.add(statement.lhs)
+        elif isinstance(statement, If):
+            stack.extend(statement.body)
+            stack.extend(statement.orelse)
+        elif isinstance(statement, While):
+            stack.extend(statement.body)
+    return names
+
+
+def _assignment_counts(statements):
+    counts = Counter()
+    stack = list(statements)
+    while stack:
+        statement = stack.pop()
+        if isinstance(statement, Assignment):
+            counts[statement.lhs] += 1
+        elif isinstance(statement, If):
+            stack.extend(statement.body)
+            stack.extend(statement.orelse)
+        elif isinstance(statement, While):
+            stack.extend(statement.body)
+    return counts
+
+
+def _contains_loop(statement):
+    stack = [statement]
+    while stack:
+        statement = stack.pop()
+        if isinstance(statement, While):
+            return True
+        if isinstance(statement, If):
+            stack.extend(statement.body)
+            stack.extend(statement.orelse)
+    return False
+
+
+def _map_expressions(statements, function):
+    """Return statements with every expression, nested ones included, replaced by function(expression)."""
+    mapped = []
+    for statement in statements:
+        if isinstance(statement, Assignment):
+            mapped.append(Assignment(statement.lhs, function(statement.rhs), statement.location))
+        elif isinstance(statement, If):
+            mapped.append(If(_map_condition(statement.condition, function),
+                             _map_expressions(statement.body, function),
+                             _map_expressions(statement.orelse, function), statement.location))
+        elif isinstance(statement, While):
+            mapped.append(While(_map_condition(statement.condition, function),
+                                _map_expressions(statement.body, function), statement.location))
+    return mapped
+
+
+def _expressions(statements):
+    """Yield every expression in statements, conditions and nested blocks included."""
+    stack = list(statements)
+    while stack:
+        statement = stack.pop()
+        if isinstance(statement, Assignment):
+            yield statement.rhs
+            continue
+        yield statement.condition.left
+        yield statement.condition.right
+        stack.extend(statement.body)
+        if isinstance(statement, If):
+            stack.extend(statement.orelse)
+
+
+def _map_condition(condition, function):
+    return type(condition)(condition.op, function(condition.left), function(condition.right))
+
+
+def _induction_step(statement):
+    """Return d if statement is lhs = lhs + d, d + lhs or lhs - d for a constant d, else None."""
+    rhs = statement.rhs
+    if not isinstance(rhs, BinOp):
+        return None
+    left, right = rhs.left, rhs.right
+    if rhs.op == 'PLUS':
+        if isinstance(left, Var) and left.name == statement.lhs and isinstance(right, Num):
+            return right.value
+        if isinstance(right, Var) and right.name == statement.lhs and isinstance(left, Num):
+            return left.value
+    elif rhs.op == 'MINUS':
+        if isinstance(left, Var) and left.name == statement.lhs and isinstance(right, Num):
+            return -right.value
+    return None
+
+
+def _product(node):
+    """Return (variable, constant) if node is variable * constant or constant * variable, else None."""
+    if isinstance(node, BinOp) and node.op == 'MUL':
+        if isinstance(node.left, Var) and isinstance(node.right, Num):
+            return node.left.name, node.right.value
+        if isinstance(node.right, Var) and isinstance(node.left, Num):
+            return node.right.name, node.left.value
+    return None
+
+
+class LoopOptimizer:
+    """Loop-invariant code motion and strength reduction over the statement tree.
+
+    Loops are optimized innermost first. An expression that only reads
+    variables the loop never assigns is computed once into a temporary
+    before the loop; so is i * c for an induction variable i (assigned only
+    by i = i + d), which is then kept up to date by adding d * c after each
+    step of i. Strength reduction is only applied where it lowers the
+    instruction count, that is for products used more than twice.
+
+    A rewritten loop is guarded by an 'if' on its original condition, so the
+    temporaries are only computed when the loop runs at least once. Only
+    expressions that the first iteration evaluates unconditionally are
+    hoisted, so the program fails (or not) exactly as before. Temporaries
+    are named .inv<n> and .iv<n>; no source identifier can start with '.'.
+    """
+
+    def __init__(self):
+        self.hoisted = 0  # Invariant expressions moved out of loops
+        self.reduced = 0  # Products of an induction variable replaced by additions
+        self._temporaries = itertools.count()
+
+    def __repr__(self):
+        return f"LoopOptimizer(hoisted={self.hoisted}, reduced={self.reduced})"
+
+    def optimize(self, statements):
+        return [self.statement(statement) for statement in statements]
+
+    def statement(self, statement):
+        """Return statement with every loop in it optimized."""
+        if isinstance(statement, If):
+            return If(statement.condition, self.optimize(statement.body), self.optimize(statement.orelse),
+                      statement.location)
+        if isinstance(statement, While):
+            return self._loop(While(statement.condition, self.optimize(statement.body), statement.location))
+        return statement
+
+    def _loop(self, loop):
+        preheader = []
+        optimized = self._hoist_invariants(loop, preheader)
+        optimized = self._reduce_strength(optimized, preheader)
+        if not preheader:
+            return loop
+        # The guard tests the original condition, since the temporaries do not exist yet
+        return If(loop.condition, preheader + [optimized], location=loop.location)
+
+    def _hoist_invariants(self, loop, preheader):
+        assigned = assigned_variables(loop.body)
+        hoisted = {}  # Expression key -> Var of the temporary holding it
+        keys = {}  # Structure -> small integer key, so equal expressions share a temporary
+
+        def materialize(entry, may_hoist):
+            node, invariant, reads, key = entry
+            if not (invariant and reads and isinstance(node, BinOp)):
+                return node
+            temporary = hoisted.get(key)
+            if temporary is None:
+                if not may_hoist:
+                    return node
+                temporary = hoisted[key] = Var(f".inv{next(self._temporaries)}")
+                preheader.append(Assignment(temporary.name, node, loop.location))
+                self.hoisted += 1
+            return temporary
+
+        def rewrite(node, may_hoist):
+            # Entries are (node, invariant, reads a variable, key when invariant)
+            results = []
+            stack = [(node, False)]
+            while stack:
+                node, children_done = stack.pop()
+                if isinstance(node, Num):
+                    results.append((node, True, False, keys.setdefault(('#', node.value), len(keys))))
+                elif isinstance(node, Var):
+                    invariant = node.name not in assigned
+                    key = keys.setdefault(('$', node.name), len(keys)) if invariant else None
+                    results.append((node, invariant, True, key))
+                elif children_done:
+                    right = results.pop()
+                    left = results.pop()
+                    if left[1] and right[1]:
+                        key = keys.setdefault((node.op, left[3], right[3]), len(keys))
+                        results.append((BinOp(node.op, left[0], right[0]), True, left[2] or right[2], key))
+                    else:
+                        results.append((BinOp(node.op, materialize(left, may_hoist), materialize(right, may_hoist)),
+                                        False, True, None))
+                else:
+                    stack.append((node, True))
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+            return materialize(results.pop(), may_hoist)
+
+        # The condition and the statements before any inner loop run unconditionally
+        # in the first iteration, so their invariant parts may be computed up front
+        condition = _map_condition(loop.condition, lambda node: rewrite(node, True))
+        body = []
+        may_hoist = True
+        for statement in loop.body:
+            if may_hoist and isinstance(statement, Assignment):
+                body.append(Assignment(statement.lhs, rewrite(statement.rhs, True), statement.location))
+                continue
+            if may_hoist and isinstance(statement, If):
+                statement = If(_map_condition(statement.condition, lambda node: rewrite(node, True)),
+                               statement.body, statement.orelse, statement.location)
+            if _contains_loop(statement):
+                may_hoist = False
+            # Anywhere else, expressions already computed before the loop are still reused
+            body.extend(_map_expressions([statement], lambda node: rewrite(node, False)))
+        return While(condition, body, loop.location)
+
+    def _reduce_strength(self, loop, preheader):
+        counts = _assignment_counts(loop.body)
+        steps = {}  # Induction variable -> (index of its update in the body, step)
+        for index, statement in enumerate(loop.body):
+            if isinstance(statement, Assignment) and counts[statement.lhs] == 1:
+                step = _induction_step(statement)
+                if step is not None:
+                    steps[statement.lhs] = (index, step)
+        if not steps:
+            return loop
+
+        uses = Counter()
+        stack = list(_expressions([loop]))
+        while stack:
+            node = stack.pop()
+            product = _product(node)
+            if product is not None and product[0] in steps:
+                uses[product] += 1
+            elif isinstance(node, BinOp):
+                stack.append(node.left)
+                stack.append(node.right)
+        reduced = {product: Var(f".iv{next(self._temporaries)}") for product, used in uses.items()
+                   if used * (_PRODUCT_COST - _REDUCED_USE_COST) > _UPDATE_COST}
+        if not reduced:
+            return loop
+
+        def replace(node):
+            results = []
+            stack = [(node, False)]
+            while stack:
+                node, children_done = stack.pop()
+                temporary = reduced.get(_product(node))
+                if temporary is not None:
+                    results.append(temporary)
+                elif not isinstance(node, BinOp):
+                    results.append(node)
+                elif children_done:
+                    right = results.pop()
+                    left = results.pop()
+                    results.append(BinOp(node.op, left, right))
+                else:
+                    stack.append((node, True))
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+            return results.pop()
+
+        updates = {}  # Body index -> assignments that follow it
+        for (name, factor), temporary in reduced.items():
+            index, step = steps[name]
+            preheader.append(Assignment(temporary.name, BinOp('MUL', Var(name), Num(factor)), loop.location))
+            increment = step * factor
+            update = BinOp('PLUS' if increment >= 0 else 'MINUS', temporary, Num(abs(increment)))
+            updates.setdefault(index, []).append(Assignment(temporary.name, update, loop.body[index].location))
+            self.reduced += 1
+        body = []
+        for index, statement in enumerate(_map_expressions(loop.body, replace)):
+            body.append(statement)
+            body.extend(updates.get(index, ()))
+        return While(_map_condition(loop.condition, replace), body, loop.location)
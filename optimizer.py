@@ -0,0 +1,167 @@
+from collections import deque
+
+from expressions import EVALUATORS, BinOp, Num, Var
+
+
+def simplify(node, values):
+    """Substitute known variable values into an expression tree and fold constant operations.
+
+    values maps variable names to the Num or Var they are known to hold.
+    Division by zero is left in place so that it still fails at run time.
+    """
+    results = []
+    stack = [(node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if isinstance(node, Num):
+            results.append(node)
+        elif isinstance(node, Var):
+            results.append(values.get(node.name, node))
+        elif children_done:
+            right = results.pop()
+            left = results.pop()
+            if (isinstance(left, Num) and isinstance(right, Num)
+                    and not (node.op == 'DIV' and right.value == 0)):
+                results.append(Num(EVALUATORS[node.op](left.value, right.value)))
+            else:
+                results.append(BinOp(node.op, left, right))
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return results.pop()
+
+
+def variables_read(node):
+    """Return the set of variable names an expression tree reads."""
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Var):
+            names.add(node.name)
+        elif isinstance(node, BinOp):
+            stack.append(node.left)
+            stack.append(node.right)
+    return names
+
+
+def can_trap(node):
+    """Return True if evaluating an expression tree can fail, by dividing by anything but a non-zero constant."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, BinOp):
+            if node.op == 'DIV' and not (isinstance(node.right, Num) and node.right.value != 0):
+                return True
+            stack.append(node.left)
+            stack.append(node.right)
+    return False
+
+
+class _PendingStore:
+    __slots__ = ('lhs', 'expression', 'location', 'state')
+
+    def __init__(self, lhs, expression, location):
+        self.lhs = lhs
+        self.expression = expression
+        self.location = location
+        self.state = None  # None while undecided, then 'live' or 'dead'
+
+
+class Optimizer:
+    """Statement-level optimizations applied between parsing and emission.
+
+    Feed every assignment through assignment() in program order and call
+    barrier() wherever control flow can enter or leave (around every block) and
+    finish() at the end of the program; each returns the (lhs, expression,
+    location) triples that are ready to be emitted, in order, where location
+    is whatever was passed in with the assignment.
+
+    Level 1 folds constant expressions and propagates constants and copies
+    from earlier assignments. Level 2 also drops stores that are overwritten
+    before anything reads them, unless their expression can divide by zero.
+    Values are only tracked within straight-line code: a barrier forgets
+    everything and keeps all pending stores, since code after it may read
+    them.
+    """
+
+    def __init__(self, level=1):
+        self.level = level
+        self.values = {}  # Variable -> Num or Var it currently holds
+        self.copies = {}  # Variable -> variables recorded as copies of it
+        self.pending = deque()  # Stores whose liveness is not known yet, in program order
+        self.last_store = {}  # Variable -> its latest undecided _PendingStore
+        self.eliminated = 0  # Stores removed as dead
+
+    def assignment(self, lhs, expression, location=None):
+        if expression is None:
+            return self.barrier() + [(lhs, None, location)]
+
+        expression = simplify(expression, self.values)
+        self._forget(lhs)
+        if isinstance(expression, Num):
+            self.values[lhs] = expression
+        elif isinstance(expression, Var) and expression.name != lhs:
+            self.values[lhs] = expression
+            self.copies.setdefault(expression.name, set()).add(lhs)
+
+        if self.level < 2:
+            return [(lhs, expression, location)]
+
+        for name in variables_read(expression):
+            store = self.last_store.pop(name, None)
+            if store is not None:
+                store.state = 'live'
+        previous = self.last_store.get(lhs)
+        if previous is not None:
+            previous.state = 'dead'
+            self.eliminated += 1
+        store = _PendingStore(lhs, expression, location)
+        self.pending.append(store)
+        if can_trap(expression):
+            # Removing it could hide a division by zero, so it stays whatever follows
+            store.state = 'live'
+            self.last_store.pop(lhs, None)
+        else:
+            self.last_store[lhs] = store
+        return self._ready()
+
+    def barrier(self):
+        self.values.clear()
+        self.copies.clear()
+        for store in self.pending:
+            if store.state is None:
+                store.state = 'live'
+        self.last_store.clear()
+        return self._ready()
+
+    def finish(self):
+        return self.barrier()
+
+    def _forget(self, name):
+        """Drop everything known about name, which is about to be reassigned."""
+        self.values.pop(name, None)
+        for copy in self.copies.pop(name, ()):
+            value = self.values.get(copy)
+            if isinstance(value, Var) and value.name == name:
+                del self.values[copy]
+
+    def _ready(self):
+        ready = []
+        pending = self.pending
+        while pending and pending[0].state is not None:
+            store = pending.popleft()
+            if store.state == 'live':
+                ready.append((store.lhs, store.expression, store.location))
+        return ready
+
+
+def instruction_count(lines):
+    """Count executable instructions, ignoring comments and labels."""
+    count = 0
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith(';') and not line.endswith(':'):
+            count += 1
+    return count
@@ -0,0 +1,101 @@
+import ast
+import itertools
+
+from expressions import Assignment, If, Num, Var, While
+
+BINARY_OPERATORS = {'PLUS': ast.Add, 'MINUS': ast.Sub, 'MUL': ast.Mult, 'DIV': ast.FloorDiv}
+COMPARISON_OPERATORS = {'GT': ast.Gt, 'LT': ast.Lt, 'EQ': ast.Eq, 'GEQ': ast.GtE}
+
+# CPython's compiler recurses over the AST, so very deep expressions are
+# split up through temporaries. Their names start with '.', which no source
+# identifier can, so they never clash with program variables.
+MAX_EXPRESSION_DEPTH = 200
+# Source identifiers are lowered to names with this prefix, so that names
+# Python reserves, such as None, True or __builtins__, stay ordinary variables.
+NAME_PREFIX = '$'
+
+
+def _name(identifier, context):
+    return ast.Name(NAME_PREFIX + identifier, context)
+
+
+class _Lowering:
+    def __init__(self):
+        self.temporaries = itertools.count()
+
+    def expression(self, node, prelude):
+        """Lower an expression tree; statements for any temporaries are appended to prelude."""
+        results = []  # (ast node, depth)
+        stack = [(node, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if isinstance(node, Num):
+                results.append((ast.Constant(node.value), 1))
+            elif isinstance(node, Var):
+                results.append((_name(node.name, ast.Load()), 1))
+            elif children_done:
+                right, right_depth = results.pop()
+                left, left_depth = results.pop()
+                lowered = ast.BinOp(left, BINARY_OPERATORS[node.op](), right)
+                depth = max(left_depth, right_depth) + 1
+                if depth >= MAX_EXPRESSION_DEPTH:
+                    name = f".t{next(self.temporaries)}"
+                    prelude.append(ast.Assign([ast.Name(name, ast.Store())], lowered))
+                    lowered, depth = ast.Name(name, ast.Load()), 1
+                results.append((lowered, depth))
+            else:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+        return results.pop()[0]
+
+    def block(self, statements):
+        lowered = []
+        for statement in statements:
+            if isinstance(statement, Assignment):
+                value = self.expression(statement.rhs, lowered)
+                lowered.append(ast.Assign([_name(statement.lhs, ast.Store())], value))
+            elif isinstance(statement, If):
+                condition = statement.condition
+                left = self.expression(condition.left, lowered)
+                right = self.expression(condition.right, lowered)
+                test = ast.Compare(left, [COMPARISON_OPERATORS[condition.op]()], [right])
+                lowered.append(ast.If(test, self.block(statement.body) or [ast.Pass()], self.block(statement.orelse)))
+            elif isinstance(statement, While):
+                # The condition is re-evaluated every iteration, so any temporaries
+                # it needs are computed inside the loop rather than before it
+                condition = statement.condition
+                prelude = []
+                left = self.expression(condition.left, prelude)
+                right = self.expression(condition.right, prelude)
+                test = ast.Compare(left, [COMPARISON_OPERATORS[condition.op]()], [right])
+                body = self.block(statement.body)
+                if prelude:
+                    exit_test = ast.If(ast.UnaryOp(ast.Not(), test), [ast.Break()], [])
+                    lowered.append(ast.While(ast.Constant(True), prelude + [exit_test] + body, []))
+                else:
+                    lowered.append(ast.While(test, body or [ast.Pass()], []))
+            else:
+                raise ValueError(f"Unsupported statement: {type(statement).__name__}")
+        return lowered
+
+
+def lower_program(statements):
+    """Lower the statements from parse_instructions() into a Python ast.Module."""
+    module = ast.Module(_Lowering().block(statements), [])
+    return ast.fix_missing_locations(module)
+
+
+def run(code, variables=None):
+    """Execute a code object from lower_program() and return the program's variables."""
+    namespace = {'__builtins__': {}}
+    if variables:
+        namespace.update((NAME_PREFIX + name, value) for name, value in variables.items())
+    try:
+        exec(code, namespace)
+    except NameError as error:
+        raise RuntimeError(f"Variable {error.name.removeprefix(NAME_PREFIX)!r} read before assignment") from None
+    except ZeroDivisionError:
+        raise RuntimeError("Division by zero") from None
+    return {name.removeprefix(NAME_PREFIX): value for name, value in namespace.items()
+            if name.startswith(NAME_PREFIX)}
@@ -0,0 +1,188 @@
+import heapq
+import re
+
+from cfg import ControlFlowGraph, split_instruction
+
+REGISTER = re.compile(r'R\d+$')
+ARITHMETIC = {'ADD', 'SUB', 'MUL', 'DIV'}
+
+
+def register_uses_and_defs(opcode, operands):
+    """Return the (used, defined) virtual registers of one instruction."""
+    if opcode == 'LOAD' or opcode == 'RELOAD':
+        return [], [operands[0]]
+    if opcode == 'STORE' or opcode == 'SPILL':
+        return [operands[1]], []
+    if opcode == 'MOVE':
+        return [operands[1]], [operands[0]]
+    if opcode in ARITHMETIC:
+        return [operands[0], operands[1]], [operands[0]]
+    # Comparisons and any other register operands are read only
+    return [operand for operand in operands if REGISTER.match(operand)], []
+
+
+class AllocationResult:
+    """Assembly rewritten onto physical registers, with the spill code that was needed."""
+
+    def __init__(self, lines, num_registers, spills, reloads, stack_slots, virtual_registers):
+        self.lines = lines
+        self.num_registers = num_registers
+        self.spills = spills  # SPILL instructions inserted
+        self.reloads = reloads  # RELOAD instructions inserted
+        self.stack_slots = stack_slots
+        self.virtual_registers = virtual_registers
+
+    def __repr__(self):
+        return (f"AllocationResult(registers={self.num_registers}, virtual={self.virtual_registers}, "
+                f"spills={self.spills}, reloads={self.reloads}, slots={self.stack_slots})")
+
+
+class LinearScanAllocator:
+    """Maps the code generator's unbounded R<n> registers onto a fixed register file.
+
+    Liveness is solved over the basic blocks of the program, each virtual
+    register gets one live interval, and the intervals are assigned with
+    linear scan (Poletto & Sarkar). When more intervals overlap than there are
+    registers, the one that ends last lives in a stack slot instead and is
+    moved through two reserved scratch registers with RELOAD/SPILL around each
+    instruction that touches it.
+    """
+
+    def __init__(self, num_registers):
+        if num_registers < 3:
+            raise ValueError("Register allocation needs at least 3 registers.")
+        self.num_registers = num_registers
+
+    def allocate(self, lines):
+        lines = list(lines)
+        instructions = [split_instruction(line) for line in lines]
+        intervals = self._live_intervals(lines, instructions)
+
+        assignment, spilled = self._scan(intervals, self.num_registers)
+        scratch = []
+        if spilled:
+            # Retry with two registers held back for moving spilled values around
+            scratch = [f"R{self.num_registers - 2}", f"R{self.num_registers - 1}"]
+            assignment, spilled = self._scan(intervals, self.num_registers - 2)
+        return self._rewrite(lines, instructions, assignment, spilled, scratch, len(intervals))
+
+    def _live_intervals(self, lines, instructions):
+        graph = ControlFlowGraph(lines, instructions)
+        blocks = [(block.start, block.end) for block in graph.blocks]
+        successors = [block.successors for block in graph.blocks]
+        uses, defs = [], []
+        for start, end in blocks:
+            block_uses, block_defs = set(), set()
+            for index in range(start, end):
+                opcode, operands = instructions[index]
+                if opcode is None:
+                    continue
+                used, defined = register_uses_and_defs(opcode, operands)
+                block_uses.update(reg for reg in used if reg not in block_defs)
+                block_defs.update(defined)
+            uses.append(block_uses)
+            defs.append(block_defs)
+
+        # Iterate the backward liveness equations to a fixed point
+        live_in = [set() for _ in blocks]
+        live_out = [set() for _ in blocks]
+        changed = True
+        while changed:
+            changed = False
+            for number in reversed(range(len(blocks))):
+                out = set()
+                for successor in successors[number]:
+                    out |= live_in[successor]
+                new_in = uses[number] | (out - defs[number])
+                if out != live_out[number] or new_in != live_in[number]:
+                    live_out[number] = out
+                    live_in[number] = new_in
+                    changed = True
+
+        # An interval spans every instruction at which the register is defined, used or live
+        intervals = {}
+
+        def extend(reg, index):
+            interval = intervals.get(reg)
+            if interval is None:
+                intervals[reg] = [index, index]
+            else:
+                interval[0] = min(interval[0], index)
+                interval[1] = max(interval[1], index)
+
+        for number, (start, end) in enumerate(blocks):
+            live = set(live_out[number])
+            for reg in live:
+                extend(reg, end - 1)
+            for index in reversed(range(start, end)):
+                opcode, operands = instructions[index]
+                if opcode is None:
+                    continue
+                used, defined = register_uses_and_defs(opcode, operands)
+                for reg in defined:
+                    extend(reg, index)
+                    live.discard(reg)
+                live.update(used)
+                for reg in live:
+                    extend(reg, index)
+        return sorted(((start, end, reg) for reg, (start, end) in intervals.items()))
+
+    @staticmethod
+    def _scan(intervals, num_registers):
+        free = [f"R{n}" for n in reversed(range(num_registers))]
+        active = []  # Heap of (end, reg, physical)
+        assignment = {}
+        spilled = set()
+        for start, end, reg in intervals:
+            while active and active[0][0] < start:
+                _, _, physical = heapq.heappop(active)
+                free.append(physical)
+            if free:
+                physical = free.pop()
+                assignment[reg] = physical
+                heapq.heappush(active, (end, reg, physical))
+                continue
+            # Spill whichever interval reaches furthest into the program
+            furthest = max(active)
+            if furthest[0] > end:
+                active.remove(furthest)
+                heapq.heapify(active)
+                spilled.add(furthest[1])
+                del assignment[furthest[1]]
+                assignment[reg] = furthest[2]
+                heapq.heappush(active, (end, reg, furthest[2]))
+            else:
+                spilled.add(reg)
+        return assignment, spilled
+
+    def _rewrite(self, lines, instructions, assignment, spilled, scratch, virtual_registers):
+        slots = {reg: f"[sp+{number}]" for number, reg in enumerate(sorted(spilled, key=lambda r: int(r[1:])))}
+        output = []
+        spills = reloads = 0
+        for line, (opcode, operands) in zip(lines, instructions):
+            if opcode is None:
+                output.append(line)
+                continue
+            used, defined = register_uses_and_defs(opcode, operands)
+            temporary = {}
+            for reg in used + defined:
+                if reg in spilled and reg not in temporary:
+                    temporary[reg] = scratch[len(temporary)]
+            for reg in dict.fromkeys(used):
+                if reg in temporary:
+                    output.append(f"RELOAD {temporary[reg]}, {slots[reg]}")
+                    reloads += 1
+            registers = set(used) | set(defined)
+            renamed = [temporary.get(operand) or assignment.get(operand, operand)
+                       if operand in registers else operand for operand in operands]
+            output.append(f"{opcode} {', '.join(renamed)}" if renamed else opcode)
+            for reg in defined:
+                if reg in temporary:
+                    output.append(f"SPILL {slots[reg]}, {temporary[reg]}")
+                    spills += 1
+        return AllocationResult(output, self.num_registers, spills, reloads, len(slots), virtual_registers)
+
+
+def allocate_registers(lines, num_registers):
+    """Allocate the virtual registers in lines onto num_registers physical ones."""
+    return LinearScanAllocator(num_registers).allocate(lines)
@@ -0,0 +1,538 @@
+from collections import Counter
+
+from expressions import COMPARE_OPCODES, EVALUATORS, OPCODES, Assignment, If, Num, Var, While, location_comment
+from loops import assigned_variables
+
+ARITHMETIC = {'ADD', 'SUB', 'MUL', 'DIV'}
+COMMUTATIVE = {'ADD', 'MUL'}
+# Assembly opcode -> the token kind EVALUATORS knows it by
+_EVALUATE = {opcode: EVALUATORS[kind] for kind, opcode in OPCODES.items()}
+
+
+class Instruction:
+    """One SSA value or effect.
+
+    opcode is CONST (data: the value), LOAD (data: a variable; its operand,
+    if any, is the PHI naming the version read), PHI (data: a variable;
+    operands per predecessor, None where the variable is unassigned), one of
+    ADD/SUB/MUL/DIV, or STORE (data: a variable). Block terminators are
+    BRANCH (data: (comparison, true block, false block)) and JUMP (data:
+    the target block). uses is the def-use chain: every instruction that
+    has this one as an operand, once per operand slot. location is the
+    (line, col) of the statement it was built for, if known.
+    """
+
+    __slots__ = ('opcode', 'operands', 'data', 'block', 'uses', 'removed', 'location')
+
+    def __init__(self, opcode, operands, data, block, location=None):
+        self.opcode = opcode
+        self.operands = operands
+        self.data = data
+        self.block = block
+        self.uses = []
+        self.removed = False
+        self.location = location
+        for operand in operands:
+            if operand is not None:
+                operand.uses.append(self)
+
+    def replace_uses(self, value):
+        """Make every user of this instruction use value instead."""
+        for user in self.uses:
+            user.operands = [value if operand is self else operand for operand in user.operands]
+            value.uses.append(user)
+        self.uses = []
+
+    def drop_operands(self):
+        for operand in self.operands:
+            if operand is not None:
+                operand.uses.remove(self)
+        self.operands = []
+
+
+class Block:
+    __slots__ = ('number', 'phis', 'instructions', 'terminator', 'idom', 'children', 'entry')
+
+    def __init__(self, number, idom):
+        self.number = number
+        self.phis = []
+        self.instructions = []
+        self.terminator = None  # None falls off the end of the program
+        self.idom = idom  # Immediate dominator; None for the entry block
+        self.children = []  # Blocks this one immediately dominates
+        self.entry = {}  # Variable -> value (or PHI) that memory holds for it when the block starts
+        if idom is not None:
+            idom.children.append(self)
+
+
+class SSAProgram:
+    """A program in SSA form: basic blocks of Instructions, built from the statement tree.
+
+    Program variables still live in memory. Every assignment is a STORE,
+    so memory always holds a variable's current value, and a PHI at a join
+    is read back with a LOAD where it is used. Values read or computed in a
+    block stay available, in registers, to every block it dominates, which
+    is what lets value numbering remove loads and arithmetic across
+    statements.
+    """
+
+    def __init__(self, statements):
+        self.blocks = []
+        self.eliminated = Counter()  # Kind of instruction -> how many were removed
+        self._variables = {}  # Variable -> its current value, or the PHI for its current version
+        self._location = None  # Source location of the statement being built
+        self._block = self._new_block(None)
+        self._statements(statements)
+
+    def __repr__(self):
+        return f"SSAProgram({len(self.blocks)} blocks, eliminated={dict(self.eliminated)})"
+
+    def _new_block(self, idom):
+        block = Block(len(self.blocks), idom)
+        self.blocks.append(block)
+        return block
+
+    def _append(self, opcode, operands, data):
+        instruction = Instruction(opcode, operands, data, self._block, self._location)
+        self._block.instructions.append(instruction)
+        return instruction
+
+    # Construction
+
+    def _read(self, name):
+        value = self._variables.get(name)
+        if value is not None and value.opcode != 'PHI':
+            return value
+        return self._append('LOAD', [value] if value is not None else [], name)
+
+    def _expression(self, node):
+        results = []
+        stack = [(node, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if isinstance(node, Num):
+                results.append(self._append('CONST', [], node.value))
+            elif isinstance(node, Var):
+                results.append(self._read(node.name))
+            elif children_done:
+                right = results.pop()
+                left = results.pop()
+                results.append(self._append(OPCODES[node.op], [left, right], None))
+            else:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+        return results.pop()
+
+    def _branch(self, condition):
+        """End the block with a test of condition; the caller fills in its targets."""
+        left = self._expression(condition.left)
+        right = self._expression(condition.right)
+        self._block.terminator = Instruction('BRANCH', [left, right], None, self._block, self._location)
+        return self._block.terminator
+
+    def _jump(self, target):
+        self._block.terminator = Instruction('JUMP', [], target, self._block, self._location)
+
+    def _statements(self, statements):
+        for statement in statements:
+            self._location = statement.location
+            if isinstance(statement, Assignment):
+                value = self._expression(statement.rhs)
+                self._append('STORE', [value], statement.lhs)
+                self._variables[statement.lhs] = value
+            elif isinstance(statement, If):
+                self._if(statement)
+            elif isinstance(statement, While):
+                self._while(statement)
+            else:
+                raise ValueError(f"Unsupported statement: {type(statement).__name__}")
+
+    def _if(self, statement):
+        # Blocks are numbered in the order they are laid out: the test, the
+        # 'if' arm, the 'else' arm, then the join
+        head = self._block
+        before = dict(self._variables)
+        branch = self._branch(statement.condition)
+        outcomes = []
+        firsts = []  # Block each arm starts in, or None for an empty arm
+        lasts = []  # Block each non-empty arm ends in, which may be later than it started
+        for body in (statement.body, statement.orelse):
+            if not body:
+                outcomes.append(before)
+                firsts.append(None)
+                continue
+            self._block = self._new_block(head)
+            firsts.append(self._block)
+            self._variables = dict(before)
+            self._block.entry = before
+            self._statements(body)
+            self._jump(None)
+            outcomes.append(self._variables)
+            lasts.append(self._block)
+
+        join = self._new_block(head)
+        # An empty arm branches straight to the join
+        then_block, else_block = (first or join for first in firsts)
+        branch.data = (statement.condition.op, then_block, else_block)
+        for last in lasts:
+            last.terminator.data = join
+
+        self._block = join
+        self._variables = {}
+        for name in set(outcomes[0]) | set(outcomes[1]):
+            then_value, else_value = outcomes[0].get(name), outcomes[1].get(name)
+            if then_value is else_value:
+                self._variables[name] = then_value
+            else:
+                phi = Instruction('PHI', [then_value, else_value], name, join)
+                join.phis.append(phi)
+                self._variables[name] = phi
+        join.entry = dict(self._variables)
+
+    def _while(self, statement):
+        self._jump(None)
+        preheader = self._block
+        header = self._new_block(preheader)
+        preheader.terminator.data = header
+        self._block = header
+        phis = []
+        for name in sorted(assigned_variables(statement.body)):
+            # The operand for the back edge is filled in once the body is built
+            phi = Instruction('PHI', [self._variables.get(name), None], name, header)
+            header.phis.append(phi)
+            phis.append(phi)
+            self._variables[name] = phi
+        at_header = dict(self._variables)
+        header.entry = dict(at_header)
+
+        branch = self._branch(statement.condition)
+        body = self._new_block(header)
+        self._block = body
+        body.entry = header.entry
+        self._statements(statement.body)
+        self._location = statement.location
+        self._jump(header)
+        for phi in phis:
+            value = self._variables.get(phi.data)
+            phi.operands[1] = value
+            if value is not None:
+                value.uses.append(phi)
+
+        self._block = self._new_block(header)
+        self._block.entry = header.entry
+        branch.data = (statement.condition.op, body, self._block)
+        self._variables = at_header
+
+    # Optimization
+
+    def value_number(self, window=None):
+        """Global value numbering: remove instructions that recompute a value available from a dominator.
+
+        Walks the dominator tree with a scoped table from (opcode, operands)
+        to the instruction that first computed it, folding arithmetic on
+        constants as it goes. Constants are only shared within a block, as
+        reloading one is as cheap as keeping it in a register. With window
+        set, a value is only reused within the same block and at most that
+        many instructions later, since with a small register file keeping
+        it live any longer costs more in spills than recomputing it.
+        """
+        table = {}
+        positions = {}  # Instruction -> its index in its block
+        stack = [(self.blocks[0], False)]
+        undo = []
+        while stack:
+            block, leaving = stack.pop()
+            if leaving:
+                for key, previous in reversed(undo.pop()):
+                    if previous is None:
+                        del table[key]
+                    else:
+                        table[key] = previous
+                continue
+            added = []
+            for index, instruction in enumerate(block.instructions):
+                if instruction.opcode in ARITHMETIC:
+                    self._fold(instruction)
+                key = self._key(instruction)
+                if key is None:
+                    continue
+                positions[instruction] = index
+                existing = table.get(key)
+                if existing is not None and window is not None and (
+                        existing.block is not block or index - positions[existing] > window):
+                    existing = None
+                if existing is not None:
+                    instruction.replace_uses(existing)
+                    instruction.drop_operands()
+                    instruction.removed = True
+                    self.eliminated['loads' if instruction.opcode == 'LOAD' else
+                                    'constants' if instruction.opcode == 'CONST' else 'arithmetic'] += 1
+                else:
+                    added.append((key, table.get(key)))
+                    table[key] = instruction
+            undo.append(added)
+            stack.append((block, True))
+            for child in reversed(block.children):
+                stack.append((child, False))
+        self._compact()
+
+    @staticmethod
+    def _key(instruction):
+        opcode = instruction.opcode
+        if opcode == 'CONST':
+            return 'CONST', instruction.data, instruction.block.number
+        if opcode == 'LOAD':
+            version = instruction.operands[0] if instruction.operands else None
+            return 'LOAD', instruction.data, id(version)
+        if opcode in ARITHMETIC:
+            # A constant operand is numbered by its value, so x + 9 in one block matches x + 9 in another
+            left, right = (('#', operand.data) if operand.opcode == 'CONST' else ('%', id(operand))
+                           for operand in instruction.operands)
+            if opcode in COMMUTATIVE and right < left:
+                left, right = right, left
+            return opcode, left, right
+        return None
+
+    def _fold(self, instruction):
+        left, right = instruction.operands
+        if left.opcode != 'CONST' or right.opcode != 'CONST':
+            return
+        if instruction.opcode == 'DIV' and right.data == 0:
+            return  # Left for run time, so that it still fails there
+        value = _EVALUATE[instruction.opcode](left.data, right.data)
+        instruction.drop_operands()
+        instruction.opcode = 'CONST'
+        instruction.data = value
+        self.eliminated['folded'] += 1
+
+    def eliminate_dead_code(self, stores=True):
+        """Remove constants and arithmetic whose values nothing uses, and stores overwritten in the same block.
+
+        Only instructions made redundant by value numbering can end up
+        unused, so removing them never hides a run-time error. A store is
+        dead when the same block stores the variable again, since a
+        variable is only loaded before its first store in a block. With
+        stores false they are all kept, as emit() can reload a value from a
+        variable that still holds it instead of keeping its register live.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for block in self.blocks:
+                for instruction in reversed(block.instructions):
+                    if instruction.removed or instruction.opcode not in ARITHMETIC | {'CONST'}:
+                        continue
+                    if not any(user.opcode != 'PHI' for user in instruction.uses):
+                        instruction.drop_operands()
+                        instruction.removed = True
+                        self.eliminated['dead'] += 1
+                        changed = True
+        for block in self.blocks if stores else ():
+            stored = set()
+            for instruction in reversed(block.instructions):
+                if instruction.opcode == 'STORE' and not instruction.removed:
+                    if instruction.data in stored:
+                        instruction.drop_operands()
+                        instruction.removed = True
+                        self.eliminated['stores'] += 1
+                    stored.add(instruction.data)
+        self._compact()
+
+    def _compact(self):
+        for block in self.blocks:
+            block.instructions = [instruction for instruction in block.instructions if not instruction.removed]
+
+    def optimize(self, num_registers=None):
+        """Run value numbering and dead code elimination, limiting reuse if num_registers is set."""
+        self.value_number(2 * num_registers if num_registers else None)
+        self.eliminate_dead_code(stores=not num_registers)
+        return self
+
+    # Emission
+
+    def emit(self, label_prefix='L', num_registers=None, source_map=False):
+        """Return the program as assembly lines, in the order its blocks were built.
+
+        With num_registers set, a value whose register has gone unused for
+        a while is reloaded where it is next used, from a variable that
+        still holds it or as a constant, rather than kept live across the
+        gap for the register allocator to spill. With source_map set, a
+        '; line L:C' comment precedes the code of each source location.
+        """
+        lines = []
+        comments = 0  # Location comments in lines, which do not count towards a register's gap
+        location = None
+        registers = {}
+        counter = 0
+        # Uses that read a register; a PHI is read back from memory instead
+        remaining = {}
+        stored_as = {}  # Value -> variables it is stored to
+        for block in self.blocks:
+            for instruction in block.instructions + ([block.terminator] if block.terminator else []):
+                for operand in instruction.operands:
+                    remaining[operand] = remaining.get(operand, 0) + 1
+                if instruction.opcode == 'STORE':
+                    stored_as.setdefault(instruction.operands[0], []).append(instruction.data)
+        touched = {}  # Value -> index in lines where its register was last written or read
+        # Lines a register may go unused before its value is reloaded instead; the
+        # allocator keeps two registers back once anything spills, so the budget is tight
+        gap = 2 * (num_registers - 3) if num_registers else None
+        labels = {}
+
+        def label(block):
+            if block not in labels:
+                labels[block] = f"{label_prefix}{len(labels)}"
+            return labels[block]
+
+        def now():
+            return len(lines) - comments
+
+        def mark(instruction):
+            nonlocal comments, location
+            if source_map and instruction.location is not None and instruction.location != location:
+                location = instruction.location
+                lines.append(location_comment(location))
+                comments += 1
+
+        def new_register():
+            nonlocal counter
+            counter += 1
+            return f"R{counter - 1}"
+
+        def home(value, holding):
+            """Return the operand to reload value from, or None if memory no longer holds it."""
+            if value.opcode == 'CONST':
+                return f"#{value.data}"
+            if value.opcode == 'LOAD':
+                version = value.operands[0] if value.operands else None
+                return value.data if holding.get(value.data) is version else None
+            for name in stored_as.get(value, ()):
+                if holding.get(name) is value:
+                    return name
+            return None
+
+        targets = set()
+        for block in self.blocks:
+            if block.terminator is not None:
+                if block.terminator.opcode == 'JUMP':
+                    targets.add(block.terminator.data)
+                else:
+                    _, if_true, if_false = block.terminator.data
+                    targets.add(if_false)
+                    if block.number + 1 < len(self.blocks) and if_true is not self.blocks[block.number + 1]:
+                        targets.add(if_true)
+                    elif block.terminator.data[0] == 'GEQ':
+                        targets.add(if_true)
+        for block in self.blocks:
+            if block in targets:
+                lines.append(f"{label(block)}:")
+            holding = dict(block.entry)
+            local = {}  # Value -> register it was reloaded into in this block
+
+            def stale(value):
+                return num_registers and now() - touched[value] > gap
+
+            def register(value):
+                """Return the register holding value, loading it first if it is a constant not yet loaded here or stale."""
+                reg = local.get(value) or registers.get(value)
+                if reg is None or stale(value):
+                    source = home(value, holding)
+                    if source is not None:
+                        reg = local[value] = new_register()
+                        lines.append(f"LOAD {reg}, {source}")
+                touched[value] = now()
+                return reg
+
+            def consumable(value):
+                """True if this is the last use of value and its register is written in this block."""
+                return remaining[value] == 1 and (value.block is block or value in local)
+
+            for instruction in block.instructions:
+                opcode = instruction.opcode
+                if opcode == 'CONST':
+                    # Loaded where it is first used, to keep its register's life short
+                    touched[instruction] = now()
+                    continue
+                mark(instruction)
+                if opcode == 'LOAD':
+                    registers[instruction] = new_register()
+                    lines.append(f"LOAD {registers[instruction]}, {instruction.data}")
+                elif opcode == 'STORE':
+                    lines.append(f"STORE {instruction.data}, {register(instruction.operands[0])}")
+                    holding[instruction.data] = instruction.operands[0]
+                else:
+                    left, right = instruction.operands
+                    if left is not right and consumable(left):
+                        target = register(left)
+                        source = register(right)
+                    elif opcode in COMMUTATIVE and left is not right and consumable(right):
+                        target = register(right)
+                        source = register(left)
+                    else:
+                        target = new_register()
+                        reload = home(left, holding) if left.opcode == 'CONST' or stale(left) else None
+                        if reload is not None:
+                            lines.append(f"LOAD {target}, {reload}")
+                            touched[left] = now()
+                        else:
+                            lines.append(f"MOVE {target}, {register(left)}")
+                        # x * x reads the copy it has just made
+                        source = target if right is left else register(right)
+                    lines.append(f"{opcode} {target}, {source}")
+                    registers[instruction] = target
+                touched[instruction] = now()
+                for operand in instruction.operands:
+                    remaining[operand] -= 1
+
+            terminator = block.terminator
+            following = self.blocks[block.number + 1] if block.number + 1 < len(self.blocks) else None
+            if terminator is None:
+                continue
+            if terminator.opcode == 'JUMP':
+                if terminator.data is not following:
+                    mark(terminator)
+                    lines.append(f"JUMP {label(terminator.data)}")
+                continue
+            comparison, if_true, if_false = terminator.data
+            mark(terminator)
+            left, right = (register(operand) for operand in terminator.operands)
+            if comparison == 'GEQ':
+                # There is no CMP_GE, so leave when left < right instead
+                lines.append(f"CMP_LT {left}, {right}")
+                lines.append(f"JUMP_IF_FALSE {label(if_true)}")
+                lines.append(f"JUMP {label(if_false)}")
+            else:
+                lines.append(f"{COMPARE_OPCODES[comparison]} {left}, {right}")
+                lines.append(f"JUMP_IF_FALSE {label(if_false)}")
+                if if_true is not following:
+                    lines.append(f"JUMP {label(if_true)}")
+        return lines
+
+    def dump(self):
+        """Return the IR as text, for debugging."""
+        out = []
+        names = {}
+
+        def name(value):
+            if value is None:
+                return "undef"
+            return names.setdefault(value, f"%{len(names)}")
+
+        for block in self.blocks:
+            idom = f" (idom b{block.idom.number})" if block.idom else ""
+            out.append(f"b{block.number}:{idom}")
+            for instruction in block.phis + block.instructions:
+                operands = ", ".join(name(operand) for operand in instruction.operands)
+                data = "" if instruction.data is None else f" {instruction.data}"
+                out.append(f"  {name(instruction)} = {instruction.opcode}{data} {operands}".rstrip()
+                           + f"  ; {len(instruction.uses)} uses")
+            terminator = block.terminator
+            if terminator is not None and terminator.opcode == 'JUMP':
+                out.append(f"  JUMP b{terminator.data.number}")
+            elif terminator is not None:
+                comparison, if_true, if_false = terminator.data
+                left, right = terminator.operands
+                out.append(f"  BRANCH {comparison} {name(left)}, {name(right)} ? b{if_true.number} : b{if_false.number}")
+        return "\n".join(out)
+
@@ -0,0 +1,70 @@
+from array import array
+
+# Every token kind the lexer can produce; a kind is stored as its index here
+TOKEN_KINDS = ('NUMBER', 'EQ', 'GEQ', 'ASSIGN', 'ID', 'PLUS', 'MINUS', 'MUL', 'DIV', 'LT', 'GT',
+               'LPAREN', 'RPAREN', 'NEWLINE', 'KEYWORD', 'INDENT', 'DEDENT')
+KIND_CODES = {kind: code for code, kind in enumerate(TOKEN_KINDS)}
+NEWLINE, KEYWORD, INDENT, DEDENT = (KIND_CODES[kind] for kind in ('NEWLINE', 'KEYWORD', 'INDENT', 'DEDENT'))
+
+
+class TokenBuffer:
+    """A token stream stored as parallel arrays instead of a list of tuples.
+
+    Each token costs one byte for its kind (an index into TOKEN_KINDS) and
+    two offsets into the source, where its text is sliced from on demand.
+    Indexing and iteration still give (kind, value) pairs, so code written
+    for token lists works unchanged; hot loops should read kinds directly.
+    """
+
+    __slots__ = ('source', 'line_num', 'kinds', 'starts', 'ends')
+
+    def __init__(self, source='', line_num=1):
+        self.source = source
+        self.line_num = line_num  # Line number of the start of source, for source locations
+        self.kinds = array('B')
+        typecode = 'I' if len(source) < 2 ** 32 else 'Q'
+        self.starts = array(typecode)
+        self.ends = array(typecode)
+
+    @classmethod
+    def from_pairs(cls, tokens):
+        """Build a buffer from (kind, value) pairs, such as the tokens of an older caller."""
+        values = []
+        buffer = cls()
+        offset = 0
+        for kind, value in tokens:
+            buffer.kinds.append(KIND_CODES[kind])
+            buffer.starts.append(offset)
+            offset += len(value)
+            buffer.ends.append(offset)
+            values.append(value)
+        buffer.source = ''.join(values)
+        return buffer
+
+    def append(self, code, start, end):
+        self.kinds.append(code)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def value(self, index):
+        return self.source[self.starts[index]:self.ends[index]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return TOKEN_KINDS[self.kinds[index]], self.source[self.starts[index]:self.ends[index]]
+
+    def __iter__(self):
+        source = self.source
+        for code, start, end in zip(self.kinds, self.starts, self.ends):
+            yield TOKEN_KINDS[code], source[start:end]
+
+    def __repr__(self):
+        return f"TokenBuffer({list(self)!r})"
+
+    def nbytes(self):
+        """Return the bytes held by the token arrays (the source itself is shared, not counted)."""
+        return sum(len(values) * values.itemsize for values in (self.kinds, self.starts, self.ends))
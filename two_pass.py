@@ -1,65 +1,127 @@
+import argparse
+import logging
 import re
+import sys
+
+from compile_stats import CompileStats, log_trace
+from expressions import emit_expression, parse_expression
+from optimizer import Optimizer, instruction_count
+from regalloc import allocate_registers
+
+# Token table, compiled once at import time. Multi-character operators come
+# before their single-character prefixes so that '==' and '>=' are not split.
+TOKEN_SPECIFICATION = [
+    ('NUMBER', r'\d+'),                      # Integer number
+    ('EQ', r'=='),                          # Equal to operator
+    ('GEQ', r'>='),                         # Greater than equal to operator
+    ('ASSIGN', r'='),                       # Assignment operator
+    ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),      # Identifier
+    ('PLUS', r'\+'),                        # Plus sign
+    ('MINUS', r'-'),                        # Minus sign
+    ('MUL', r'\*'),                         # Multiplication sign
+    ('DIV', r'/'),                          # Division sign
+    ('LT', r'<'),                           # Less than operator
+    ('GT', r'>'),                           # Greater than operator
+    ('LPAREN', r'\('),                      # Left Parenthesis
+    ('RPAREN', r'\)'),                      # Right Parenthesis
+    ('NEWLINE', r'\n'),                     # Newline
+    ('SKIP', r'[ \t\r]+'),                  # Whitespace other than newlines
+    ('MISMATCH', r'.'),                     # Any other character
+]
+TOK_REGEX = re.compile('|'.join(f'(?P<{pair[0]}>{pair[1]})' for pair in TOKEN_SPECIFICATION))
+KEYWORDS = frozenset({'if', 'else', 'while'})
+
+
+def tokenize(code, keywords=KEYWORDS, line_num=1):
+    """Lazily yield (kind, value, line, col) tokens; line and col are 1-based."""
+    line_start = 0
+    for mo in TOK_REGEX.finditer(code):
+        kind = mo.lastgroup
+        value = mo.group()
+        if kind == 'NEWLINE':
+            yield kind, value, line_num, mo.start() - line_start + 1
+            line_num += 1
+            line_start = mo.end()
+        elif kind == 'SKIP':
+            continue
+        elif kind == 'MISMATCH':
+            raise RuntimeError(f'{value!r} unexpected on line {line_num}')
+        elif kind == 'ID' and value in keywords:  # Check if the ID is a keyword
+            yield 'KEYWORD', value, line_num, mo.start() - line_start + 1
+        else:
+            yield kind, value, line_num, mo.start() - line_start + 1
+
+
+def tokenize_lines(lines, keywords=KEYWORDS):
+    """Like tokenize(), but over an iterable of source lines such as an open file."""
+    for line_num, line in enumerate(lines, 1):
+        yield from tokenize(line, keywords, line_num)
+
 
 class TwoPassCompiler:
-    def __init__(self):
+    def __init__(self, trace=None, num_registers=None, optimization_level=0):
         self.instructions = []  # Stores intermediate instructions
         self.in_if_block = False  # Flag to track if inside an if block
         self.code_lines = []  # Stores the final lines of Python code
         self.indentation_level = 0  # Tracks the level of indentation (e.g., inside an if block)
         self.if_conditions = []  # Stores the conditions for the if statement
         self.if_actions = []  # Stores actions inside the if statement
-        self.keywords = {'if', 'else', 'while'}  #Python keywords
+        self.keywords = KEYWORDS  #Python keywords
+        self.trace = trace  # Optional callback(event, payload) for debugging output; quiet when None
+        self.num_registers = num_registers  # Size of the target register file; None leaves registers virtual
+        self.optimization_level = optimization_level  # 0 = none, 1 = folding/propagation, 2 = also dead stores
 
     # First pass: Tokenization and parsing into intermediate representation
 
-    def first_pass(self, code):
-        token_specification = [
-            ('NUMBER', r'\d+'),                      # Integer number
-            ('ASSIGN', r'='),                       # Assignment operator
-            ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),      # Identifier
-            ('PLUS', r'\+'),                        # Plus sign
-            ('MINUS', r'-'),                        # Minus sign
-            ('MUL', r'\*'),                         # Multiplication sign
-            ('DIV', r'/'),                          # Division sign
-            ('LT', r'<'),                           # Less than operator
-            ('GT', r'>'),                           # Greater than operator
-            ('EQ', r'=='),                          # Equal to operator
-            ('GEQ',r'>='),                          # Greater than equal to operator
-            ('LPAREN', r'\('),                      # Left Parenthesis
-            ('RPAREN', r'\)'),                      # Right Parenthesis
-            ('NEWLINE', r'\n'),                     # Newline
-        ]
-        tok_regex = '|'.join(f'(?P<{pair[0]}>{pair[1]})' for pair in token_specification)
-        line_num = 1
-        line_start = 0
-        for mo in re.finditer(tok_regex, code):
-            kind = mo.lastgroup
-            value = mo.group()
-            if kind == 'NEWLINE':  # Recognize and append newlines
-                self.instructions.append((kind, value))
-                line_num += 1
-            elif kind == 'SKIP':
-                pass
-            elif kind == 'MISMATCH':
-                raise RuntimeError(f'{value!r} unexpected on line {line_num}')
-            elif kind == 'ID' and value in self.keywords:  # Check if the ID is a keyword
-                self.instructions.append(('KEYWORD', value))
-            else:
-                self.instructions.append((kind, value))
-        print("Token Stream: ", self.instructions)
+    def first_pass(self, code, stats=None):
+        self.instructions = self._lex(code, stats)
+
+    def _lex(self, code, stats=None):
+        """Return the (kind, value) token list for code without touching instance state."""
+        if stats is None:
+            stats = CompileStats()
+        with stats.phase('lexer') as lexer:
+            instructions = [(kind, value) for kind, value, _, _ in tokenize(code, self.keywords)]
+            lexer.count += len(instructions)
+        if self.trace:
+            self.trace('tokens', instructions)
+        return instructions
 
 
 
 
     # Second pass: Generate Assembly code from the intermediate instructions
-    def second_pass(self):
+    def second_pass(self, tokens=None, stats=None):
+        if tokens is None:
+            tokens = self.instructions
+        if stats is None:
+            stats = CompileStats()
+        with stats.phase('codegen') as codegen:
+            assembly_instructions = list(self._generate_assembly(tokens))
+            codegen.count += sum(1 for line in assembly_instructions if not line.startswith(';'))
+        if self.num_registers:
+            assembly_instructions = self._allocate_registers(assembly_instructions, stats)
+        return "\n".join(assembly_instructions)
+
+    def _allocate_registers(self, assembly_instructions, stats):
+        with stats.phase('regalloc') as regalloc:
+            allocation = allocate_registers(assembly_instructions, self.num_registers)
+            regalloc.count += allocation.spills
+        if self.trace:
+            self.trace('regalloc', allocation)
+        return allocation.lines
+
+    def _generate_assembly(self, tokens):
+        """Yield assembly lines for a (kind, value) token stream as each statement completes."""
         assembly_instructions = []
         register_counter = 0
         label_counter = 0
         token_stack = []
         current_keyword = None
         current_lhs = None  # To track variable assignment
-        rhs_stack = []      # To process RHS expressions
+        rhs_tokens = []     # Tokens of the RHS expression being assigned
+        trace = self.trace
+        optimizer = Optimizer(self.optimization_level) if self.optimization_level else None
 
         def allocate_register():
             nonlocal register_counter
@@ -74,7 +136,8 @@ class TwoPassCompiler:
             return label
 
         def handle_if(tokens):
-            print(tokens)
+            if trace:
+                trace('if', list(tokens))
             tokens.reverse()  # Reverse to process right-to-left
             lhs, operator, rhs = None, None, None
 
@@ -116,35 +179,38 @@ class TwoPassCompiler:
             'if': handle_if,
         }
 
-        def process_rhs():
-            """Process the RHS stack into assembly instructions."""
-            while len(rhs_stack) > 1:
-                operand1 = rhs_stack.pop(0)
-                operator = rhs_stack.pop(0)
-                operand2 = rhs_stack.pop(0)
-
-                op_map = {'PLUS': 'ADD', 'MINUS': 'SUB', 'MUL': 'MUL', 'DIV': 'DIV'}
-                if operator not in op_map:
-                    raise ValueError(f"Invalid operator: {operator}")
-
-                assembly_operator = op_map[operator]
-                temp_reg = operand1  # Use operand1 as the destination to avoid unnecessary allocation
-                assembly_instructions.append(f"{assembly_operator} {temp_reg}, {operand2}")
-                rhs_stack.insert(0, temp_reg)  # Push result back as the single remaining operand
-
-            if rhs_stack:
-                return rhs_stack.pop(0)  # Final register holding the RHS value
-            return None
+        def emit_assignment(lhs, expression):
+            assembly_instructions.append(f"; Assigning value to {lhs}")
+            if expression is not None:
+                result = emit_expression(expression, allocate_register, assembly_instructions.append)
+                assembly_instructions.append(f"STORE {lhs}, {result}")
+
+        def emit_optimized(statements):
+            for lhs, expression, _ in statements:
+                emit_assignment(lhs, expression)
+
+        def process_assignment(lhs):
+            """Compile the collected RHS tokens as an assignment to lhs."""
+            expression = parse_expression(rhs_tokens) if rhs_tokens else None
+            rhs_tokens.clear()
+            if optimizer:
+                emit_optimized(optimizer.assignment(lhs, expression))
+            else:
+                emit_assignment(lhs, expression)
 
 
         # Main loop to process instructions
-        for kind, value in self.instructions:
-            print(f"kind: {kind} value: {value}")
+        for kind, value in tokens:
+            if trace:
+                trace('token', (kind, value))
             if kind == 'KEYWORD':
                 if value in keyword_handlers:
                     if current_keyword:
                         keyword_handlers[current_keyword](token_stack)
                         token_stack = []
+                    elif optimizer:
+                        # Control flow starts here, so nothing may be carried across it
+                        emit_optimized(optimizer.barrier())
                     current_keyword = value
             elif kind == 'NEWLINE':
                 if current_keyword:
@@ -153,38 +219,30 @@ class TwoPassCompiler:
                     token_stack = []
                 elif current_lhs:
                     # Finalize variable assignment
-                    final_value = process_rhs()
-                    if final_value:
-                        assembly_instructions.append(f"STORE {current_lhs}, {final_value}")
+                    process_assignment(current_lhs)
                     current_lhs = None
+                # The statement is complete, so its code can be handed out
+                yield from assembly_instructions
+                assembly_instructions.clear()
             elif current_keyword:
                 # Collect tokens for the current keyword
                 token_stack.append((kind, value))
             else:
                 # Handle non-keyword instructions
-                if kind == 'ID':  # Variable names
-                    if current_lhs is None:
-                        current_lhs = value  # Assign LHS
-                    else:
-                        rhs_stack.append(value)  # Add to RHS stack
-                elif kind == 'ASSIGN':  # Assignment operator
-                    assembly_instructions.append(f"; Assigning value to {current_lhs}")
-                elif kind == 'NUMBER':  # Numbers
-                    reg = allocate_register()
-                    assembly_instructions.append(f"LOAD {reg}, #{value}")
-                    rhs_stack.append(reg)
-                elif kind in ['PLUS', 'MINUS', 'MUL', 'DIV']:  # Operators
-                    rhs_stack.append(kind)
+                if kind == 'ID' and current_lhs is None:  # Variable being assigned
+                    current_lhs = value
+                elif kind in ['ID', 'NUMBER', 'PLUS', 'MINUS', 'MUL', 'DIV', 'LPAREN', 'RPAREN']:
+                    rhs_tokens.append((kind, value))  # Part of the RHS expression
 
         # Handle any remaining keyword or variable assignment
         if current_keyword:
             keyword_handlers[current_keyword](token_stack)
         elif current_lhs:
-            final_value = process_rhs()
-            if final_value:
-                assembly_instructions.append(f"STORE {current_lhs}, {final_value}")
+            process_assignment(current_lhs)
+        if optimizer:
+            emit_optimized(optimizer.finish())
 
-        return "\n".join(assembly_instructions)
+        yield from assembly_instructions
 
 
 
@@ -202,20 +260,82 @@ class TwoPassCompiler:
         return "    " * self.indentation_level  # Generates indentation based on the level
 
     # Compile the source code using both passes
-    def compile(self, code):
-        # Perform the first pass: Tokenization and parsing
-        self.first_pass(code)
-        
+    def compile(self, code, stats=None):
+        # Perform the first pass: Tokenization. State stays local to this call,
+        # so a compiler can be reused and shared between threads.
+        instructions = self._lex(code, stats)
+
         # Perform the second pass: Code generation
-        python_code = self.second_pass()
-        
-        # Print the generated Python code
-        print("Generated Python Code:\n", python_code)
+        python_code = self.second_pass(instructions, stats)
+
+        if self.trace:
+            self.trace('assembly', python_code)
         return python_code
 
+    def compile_stream(self, source):
+        """Compile incrementally, yielding assembly lines as each statement completes.
+
+        source is either a string or an iterable of lines such as an open file;
+        "\n".join() over the result is identical to compile(source).
+        """
+        if isinstance(source, str):
+            tokens = tokenize(source, self.keywords)
+        else:
+            tokens = tokenize_lines(source, self.keywords)
+        assembly = self._generate_assembly((kind, value) for kind, value, _, _ in tokens)
+        if self.num_registers:
+            # Allocation needs liveness over the whole program, so this stage
+            # holds the output back until the source is exhausted.
+            assembly = self._allocate_registers(list(assembly), CompileStats())
+        return iter(assembly)
+
+
+def main(argv=None):
+    """Stream-compile a source file (or stdin) to assembly on stdout."""
+    parser = argparse.ArgumentParser(description='Compile a program to assembly.')
+    parser.add_argument('source', help="source file to compile, or '-' to read stdin")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log tokens and compiler events to stderr')
+    parser.add_argument('-r', '--registers', type=int, metavar='N',
+                        help='allocate onto N physical registers, spilling to the stack as needed')
+    parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2], default=0,
+                        help='optimization level: -O1 folds and propagates constants, -O2 also removes dead stores')
+    parser.add_argument('--report', action='store_true',
+                        help='print the instruction count before and after optimization to stderr')
+    args = parser.parse_args(argv)
+    if args.report and args.source == '-':
+        parser.error('--report needs a source file')
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    compiler = TwoPassCompiler(trace=log_trace if args.verbose else None, num_registers=args.registers,
+                               optimization_level=args.optimization_level)
+    if args.source == '-':
+        sys.stdout.writelines(line + '\n' for line in compiler.compile_stream(sys.stdin))
+        return 0
+
+    # Files are read line by line through a buffered reader, so memory use
+    # stays bounded however large the program is.
+    with open(args.source, encoding='utf-8', buffering=1 << 16) as source:
+        assembly = compiler.compile_stream(source)
+        if args.report:
+            assembly = list(assembly)
+        sys.stdout.writelines(line + '\n' for line in assembly)
+    if args.report:
+        with open(args.source, encoding='utf-8', buffering=1 << 16) as source:
+            before = instruction_count(TwoPassCompiler(num_registers=args.registers).compile_stream(source))
+        after = instruction_count(assembly)
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"instructions: {before} at -O0, {after} at -O{args.optimization_level} ({change:+.1f}%)",
+              file=sys.stderr)
+    return 0
+
 
 # Example usage
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
     code = "x = 9"
     code2 = "x = 10 + 7"
     code3 = """ 
@@ -233,7 +353,11 @@ if __name__ == '__main__':
         if 
     """
 
-    
-    compiler = TwoPassCompiler()
-    compiled_code = compiler.compile(code3)
+
+    logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    compiler = TwoPassCompiler(trace=log_trace)
+    stats = CompileStats()
+    compiled_code = compiler.compile(code3, stats)
+    print(compiled_code)
+    print(stats.report())
 
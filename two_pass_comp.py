@@ -1,129 +1,397 @@
+import argparse
+import io
+import logging
 import re
+import sys
+
+from compile_stats import CompileStats, log_trace
+from expressions import (COMPARE_OPCODES, Assignment, If, While, emit_expression, location_comment, parse_condition,
+                         parse_expression)
+from loops import LoopOptimizer
+from optimizer import Optimizer, instruction_count
+from python_backend import lower_program
+from regalloc import allocate_registers
+from ssa import SSAProgram
+from token_buffer import DEDENT, INDENT, KEYWORD, KIND_CODES, NEWLINE, TokenBuffer
+
+# Token table, compiled once at import time. Multi-character operators come
+# before their single-character prefixes so that '==' and '>=' are not split.
+TOKEN_SPECIFICATION = [
+    ('NUMBER', r'\d+'),                      # Integer number
+    ('EQ', r'=='),                          # Equal to operator
+    ('GEQ', r'>='),                         # Greater than equal to operator
+    ('ASSIGN', r'='),                       # Assignment operator
+    ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),      # Identifier
+    ('PLUS', r'\+'),                        # Plus sign
+    ('MINUS', r'-'),                        # Minus sign
+    ('MUL', r'\*'),                         # Multiplication sign
+    ('DIV', r'/'),                          # Division sign
+    ('LT', r'<'),                           # Less than operator
+    ('GT', r'>'),                           # Greater than operator
+    ('LPAREN', r'\('),                      # Left Parenthesis
+    ('RPAREN', r'\)'),                      # Right Parenthesis
+    ('NEWLINE', r'\n'),                     # Newline
+    ('SKIP', r'[ \t\r]+'),                  # Whitespace other than newlines
+    ('MISMATCH', r'.'),                     # Any other character
+]
+TOK_REGEX = re.compile('|'.join(f'(?P<{pair[0]}>{pair[1]})' for pair in TOKEN_SPECIFICATION))
+KEYWORDS = frozenset({'if', 'else', 'while'})
+# Regex group -> token kind code, for the groups that become tokens
+_GROUP_CODES = {name: KIND_CODES[name] for name, _ in TOKEN_SPECIFICATION if name not in ('SKIP', 'MISMATCH')}
+
+
+def tokenize(code, keywords=KEYWORDS, line_num=1):
+    """Lazily yield (kind, value, line, col) tokens; line and col are 1-based."""
+    line_start = 0
+    for mo in TOK_REGEX.finditer(code):
+        kind = mo.lastgroup
+        value = mo.group()
+        if kind == 'NEWLINE':
+            yield kind, value, line_num, mo.start() - line_start + 1
+            line_num += 1
+            line_start = mo.end()
+        elif kind == 'SKIP':
+            continue
+        elif kind == 'MISMATCH':
+            raise RuntimeError(f'{value!r} unexpected on line {line_num}')
+        elif kind == 'ID' and value in keywords:  # Check if the ID is a keyword
+            yield 'KEYWORD', value, line_num, mo.start() - line_start + 1
+        else:
+            yield kind, value, line_num, mo.start() - line_start + 1
+
+
+def tokenize_lines(lines, keywords=KEYWORDS):
+    """Like tokenize(), but over an iterable of source lines such as an open file."""
+    for line_num, line in enumerate(lines, 1):
+        yield from tokenize(line, keywords, line_num)
+
+
+def mark_indentation(tokens):
+    """Insert INDENT and DEDENT tokens where a line is indented deeper or shallower than the last.
+
+    The first non-blank line sets the base indentation. Dedenting to a column
+    that no enclosing line used raises RuntimeError. If the source ends
+    inside a block without a final newline, a NEWLINE ends its last line
+    before the closing DEDENTs.
+    """
+    levels = []
+    at_line_start = True
+    line_num = col = 1
+    kind = 'NEWLINE'
+    for token in tokens:
+        kind, value, line_num, col = token
+        if kind == 'NEWLINE':
+            at_line_start = True
+        elif at_line_start:
+            at_line_start = False
+            if not levels:
+                levels.append(col)
+            elif col > levels[-1]:
+                levels.append(col)
+                yield 'INDENT', '', line_num, col
+            else:
+                while len(levels) > 1 and col < levels[-1]:
+                    levels.pop()
+                    yield 'DEDENT', '', line_num, col
+                if col != levels[-1]:
+                    raise RuntimeError(f'Inconsistent indentation on line {line_num}')
+        yield token
+    if len(levels) > 1 and kind != 'NEWLINE':
+        # The source ended mid-line; end that line before closing its blocks
+        yield 'NEWLINE', '', line_num, col
+    for _ in levels[1:]:
+        yield 'DEDENT', '', line_num, col
+
+
+def lex(code, keywords=KEYWORDS, line_num=1):
+    """Lex code into a TokenBuffer, marking indentation on the way.
+
+    The tokens and errors are the same as for mark_indentation(tokenize(code)),
+    but no tuple or substring is kept per token.
+    """
+    tokens = TokenBuffer(code, line_num)
+    append = tokens.append
+    group_codes = _GROUP_CODES
+    levels = []
+    at_line_start = True
+    line_start = 0
+    for mo in TOK_REGEX.finditer(code):
+        kind = mo.lastgroup
+        if kind == 'SKIP':
+            continue
+        start, end = mo.span()
+        if kind == 'NEWLINE':
+            append(NEWLINE, start, end)
+            at_line_start = True
+            line_num += 1
+            line_start = end
+            continue
+        if kind == 'MISMATCH':
+            raise RuntimeError(f'{mo.group()!r} unexpected on line {line_num}')
+        if at_line_start:
+            at_line_start = False
+            col = start - line_start + 1
+            if not levels:
+                levels.append(col)
+            elif col > levels[-1]:
+                levels.append(col)
+                append(INDENT, start, start)
+            else:
+                while len(levels) > 1 and col < levels[-1]:
+                    levels.pop()
+                    append(DEDENT, start, start)
+                if col != levels[-1]:
+                    raise RuntimeError(f'Inconsistent indentation on line {line_num}')
+        if kind == 'ID' and mo.group() in keywords:
+            append(KEYWORD, start, end)
+        else:
+            append(group_codes[kind], start, end)
+    if len(levels) > 1 and tokens.kinds[-1] != NEWLINE:
+        # The source ended mid-line; end that line before closing its blocks
+        append(NEWLINE, len(code), len(code))
+    for _ in levels[1:]:
+        append(DEDENT, len(code), len(code))
+    return tokens
+
+
+def split_statements(lines, line_num=1, base=None):
+    """Group source lines into top-level statements, yielding (first line number, lines) for each.
+
+    A top-level statement is a line at the base indentation together with
+    the lines nested under it, and an 'else' with its block stays with the
+    'if' before it. Blank lines stay with the statement before them, or with
+    the first one when they lead the source. base is the column of the
+    program's first non-blank line, taken from lines when None. A line
+    indented less than base raises the same RuntimeError as lex().
+    """
+    pending = []
+    first_line = line_num
+    started = False  # Whether pending holds a non-blank line yet
+    for line_num, line in enumerate(lines, line_num):
+        stripped = line.lstrip(' \t\r')
+        if stripped.rstrip('\n'):
+            indent = len(line) - len(stripped)
+            if base is None:
+                base = indent
+            elif indent < base:
+                raise RuntimeError(f'Inconsistent indentation on line {line_num}')
+            if indent == base and started and stripped.split(None, 1)[0] != 'else':
+                yield first_line, pending
+                pending = []
+                first_line = line_num
+            started = True
+        pending.append(line)
+    if pending:
+        yield first_line, pending
+
+
+class CompileSession:
+    """Everything produced while compiling one program.
+
+    compile() keeps this state per call instead of on the compiler, so one
+    compiler can be shared between threads and reused indefinitely.
+    """
+
+    def __init__(self, code):
+        self.code = code
+        self.instructions = TokenBuffer(code)
+        self.parsed_output = []  # Assignment and If statements
+        self.assembly = None
+
 
 class TwoPassCompiler:
-    def __init__(self):
-        self.instructions = []  # Stores intermediate instructions
+    def __init__(self, trace=None, num_registers=None, optimization_level=0, lexer=None, source_map=False):
+        self.instructions = []  # Tokens from the last first_pass(); compile() keeps its own
+        self.parsed_output = []  # Statements from the last first_pass()
         self.in_if_block = False  # Flag to track if inside an if block
         self.code_lines = []  # Stores the final lines of Python code
         self.indentation_level = 0  # Tracks the level of indentation (e.g., inside an if block)
         self.if_conditions = []  # Stores the conditions for the if statement
         self.if_actions = []  # Stores actions inside the if statement
-        self.keywords = {'if', 'else', 'while'}  #Python keywords
+        self.keywords = KEYWORDS  #Python keywords
+        self.trace = trace  # Optional callback(event, payload) for debugging output; quiet when None
+        self.num_registers = num_registers  # Size of the target register file; None leaves registers virtual
+        self.optimization_level = optimization_level  # 0 = none, 1 = folding/propagation, 2 = also dead stores and loops, 3 = also SSA value numbering
+        self.lexer = lexer or lex  # Whole-program lexer, such as bulk_lexer.lex; streaming always uses lex()
+        self.source_map = source_map  # Precede each statement's code with a '; line L:C' comment for vm.assemble()
 
     # First pass: Tokenization and parsing into intermediate representation
 
-    def first_pass(self, code):
-        token_specification = [
-            ('NUMBER', r'\d+'),                      # Integer number
-            ('ASSIGN', r'='),                       # Assignment operator
-            ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),      # Identifier
-            ('PLUS', r'\+'),                        # Plus sign
-            ('MINUS', r'-'),                        # Minus sign
-            ('MUL', r'\*'),                         # Multiplication sign
-            ('DIV', r'/'),                          # Division sign
-            ('LT', r'<'),                           # Less than operator
-            ('GT', r'>'),                           # Greater than operator
-            ('EQ', r'=='),                          # Equal to operator
-            ('GEQ',r'>='),                          # Greater than equal to operator
-            ('LPAREN', r'\('),                      # Left Parenthesis
-            ('RPAREN', r'\)'),                      # Right Parenthesis
-            ('NEWLINE', r'\n'),                     # Newline
-        ]
-        tok_regex = '|'.join(f'(?P<{pair[0]}>{pair[1]})' for pair in token_specification)
-        line_num = 1
-        line_start = 0
-        for mo in re.finditer(tok_regex, code):
-            kind = mo.lastgroup
-            value = mo.group()
-            if kind == 'NEWLINE':  # Recognize and append newlines
-                self.instructions.append((kind, value))
-                line_num += 1
-            elif kind == 'SKIP':
-                pass
-            elif kind == 'MISMATCH':
-                raise RuntimeError(f'{value!r} unexpected on line {line_num}')
-            elif kind == 'ID' and value in self.keywords:  # Check if the ID is a keyword
-                self.instructions.append(('KEYWORD', value))
-            else:
-                self.instructions.append((kind, value))
-        print("Token Stream: ", self.instructions)
-
-        self.parsed_output = self.parse_instructions()
-        print("Parsed Output: ", self.parsed_output)
-
-
-    def parse_instructions(self):
-        parsed_output = []
-        current_statement = {}
-        in_if_block = False
-        current_if_statement = {}
-
-        for kind, value in self.instructions:
-            if kind == 'ID' and 'lhs' not in current_statement and not in_if_block:
-                # Parse assignment statements
-                current_statement['type'] = 'assignment'
-                current_statement['lhs'] = value
-                current_statement['rhs'] = []  # Initialize rhs here
-            elif kind == 'ASSIGN' and not in_if_block:
-                if 'rhs' not in current_statement:
-                    current_statement['rhs'] = []  # Ensure rhs is initialized
-            elif kind in {'NUMBER', 'ID', 'PLUS', 'MINUS', 'MUL', 'DIV'} and not in_if_block:
-                if 'rhs' not in current_statement:
-                    current_statement['rhs'] = []  # Initialize rhs just in case
-                current_statement['rhs'].append(value)
-            elif kind == 'NEWLINE':
-                if in_if_block and current_if_statement:
-                    # Finish an if-body statement
-                    if 'body' not in current_if_statement:
-                        current_if_statement['body'] = []
-                    current_if_statement['body'].append(current_statement)
-                    current_statement = {}
-                elif current_statement:
-                    # Regular statement
-                    parsed_output.append(current_statement)
-                    current_statement = {}
-            elif kind == 'KEYWORD' and value == 'if':
-                # Begin an if statement
-                in_if_block = True
-                current_if_statement = {'type': 'if', 'condition': [], 'body':[]}
-            elif kind == 'LPAREN' and in_if_block:
-                pass  # Skip '(' token
-            elif kind in {'GT', 'LT', 'EQ', 'GEQ', 'LEQ', 'NUMBER', 'ID'} and in_if_block:
-                # Add condition tokens to the if statement
-                current_if_statement['condition'].append(value)
-            elif kind == 'RPAREN' and in_if_block:
-                pass  # Skip ')' token
-            elif kind == 'NEWLINE' and in_if_block and not current_statement:
-                # If there's a newline right after the condition, it indicates the body begins
-                continue
-            elif kind == 'END' and in_if_block:
-                # Finish the if block
-                parsed_output.append(current_if_statement)
-                in_if_block = False
-                current_if_statement = {}
-
-        # Add the last statement if present
-        if current_statement:
-            parsed_output.append(current_statement)
-        if current_if_statement:
-            parsed_output.append(current_if_statement)
-
+    def first_pass(self, code, stats=None):
+        session = self._analyze(code, stats)
+        self.instructions = session.instructions
+        self.parsed_output = session.parsed_output
+
+    def _analyze(self, code, stats=None):
+        """Lex and parse code into a new CompileSession."""
+        if stats is None:
+            stats = CompileStats()
+        session = CompileSession(code)
+        with stats.phase('lexer') as lexer:
+            session.instructions = self.lexer(code, self.keywords)
+            lexer.count += len(session.instructions)
+        if self.trace:
+            self.trace('tokens', session.instructions)
+
+        with stats.phase('parser') as parser:
+            session.parsed_output = self.parse_instructions(session.instructions)
+            parser.count += len(session.parsed_output)
+        if self.trace:
+            self.trace('parsed', session.parsed_output)
+        return session
+
+    def parse_instructions(self, tokens=None):
+        """Parse a TokenBuffer (or a list of (kind, value) tokens) into a list of statements.
+
+        Assignments become Assignment(name, expression), if statements
+        If(Compare, body, orelse) and while loops While(Compare, body), where
+        a body is the block of lines indented under its 'if', 'else' or 'while'.
+        Only one line's tokens are expanded to tuples at a time. Each
+        statement records the (line, col) of its first token as its location.
+        """
+        if tokens is None:
+            tokens = self.instructions
+        if not isinstance(tokens, TokenBuffer):
+            tokens = TokenBuffer.from_pairs(tokens)
+        kinds = tokens.kinds
+        count = len(kinds)
+        position = 0
+        source = tokens.source
+        line_num = tokens.line_num
+        counted = 0  # Offset in source up to which newlines have been counted into line_num
+
+        def locate():
+            """Return the (line, col) of the token at position; statements are located in source order."""
+            nonlocal line_num, counted
+            start = tokens.starts[position]
+            line_num += source.count('\n', counted, start)
+            counted = start
+            return line_num, start - source.rfind('\n', 0, start)
+
+        def collect_line():
+            """Return the tokens up to the end of the current line and step past its NEWLINE."""
+            nonlocal position
+            start = position
+            while position < count and kinds[position] != NEWLINE:
+                position += 1
+            line = tokens[start:position]
+            position += 1
+            return line
+
+        def skip_newlines():
+            nonlocal position
+            while position < count and kinds[position] == NEWLINE:
+                position += 1
+
+        def parse_body():
+            """Parse the block indented under the current line, which may be empty."""
+            nonlocal position
+            skip_newlines()
+            if position < count and kinds[position] == INDENT:
+                position += 1
+                return parse_block()
+            return []
+
+        def parse_block():
+            nonlocal position
+            block = []
+            while position < count:
+                kind = kinds[position]
+                if kind == NEWLINE:
+                    position += 1
+                elif kind == DEDENT:
+                    position += 1
+                    break
+                elif kind == INDENT:
+                    raise ValueError("Unexpected indentation.")
+                elif kind == KEYWORD:
+                    location = locate()
+                    value = tokens.value(position)
+                    position += 1
+                    if value == 'if':
+                        condition = parse_condition(collect_line())
+                        body = parse_body()
+                        orelse = []
+                        skip_newlines()
+                        if position < count and kinds[position] == KEYWORD and tokens.value(position) == 'else':
+                            position += 1
+                            if collect_line():
+                                raise ValueError("Unexpected tokens after 'else'.")
+                            orelse = parse_body()
+                        block.append(If(condition, body, orelse, location))
+                    elif value == 'while':
+                        condition = parse_condition(collect_line())
+                        block.append(While(condition, parse_body(), location))
+                    elif value == 'else':
+                        raise ValueError("'else' without a matching 'if'.")
+                    else:
+                        raise ValueError(f"Unsupported keyword: {value}")
+                else:
+                    location = locate()
+                    line = collect_line()
+                    if len(line) < 3 or line[0][0] != 'ID' or line[1][0] != 'ASSIGN':
+                        raise ValueError(f"Expected an assignment: {' '.join(value for _, value in line)}")
+                    block.append(Assignment(sys.intern(line[0][1]), parse_expression(line[2:]), location))
+            return block
+
+        parsed_output = parse_block()
+        if position < count:
+            raise ValueError("Unexpected dedent.")
         return parsed_output
 
 
 
 
 
-    # Second pass: Generate Assembly code from the intermediate instructions
-    def second_pass(self):
+    # Second pass: Generate Assembly code from the parsed statements
+    def second_pass(self, statements=None, stats=None, label_prefix='L'):
+        """Generate assembly for parsed statements (by default those from the last first_pass()).
+
+        Tokens are accepted too, for older callers, and are parsed first.
+        """
+        if statements is None:
+            statements = self.parsed_output
+        elif isinstance(statements, TokenBuffer) or (statements and isinstance(statements[0], tuple)):
+            statements = self.parse_instructions(statements)
+        if stats is None:
+            stats = CompileStats()
+        with stats.phase('codegen') as codegen:
+            assembly_instructions = list(self._generate_assembly(statements, label_prefix))
+            codegen.count += instruction_count(assembly_instructions)
+        if self.num_registers:
+            assembly_instructions = self._allocate_registers(assembly_instructions, stats)
+        return "\n".join(assembly_instructions)
+
+    def _allocate_registers(self, assembly_instructions, stats):
+        with stats.phase('regalloc') as regalloc:
+            allocation = allocate_registers(assembly_instructions, self.num_registers)
+            regalloc.count += allocation.spills
+        if self.trace:
+            self.trace('regalloc', allocation)
+        return allocation.lines
+
+    def _generate_assembly(self, statements, label_prefix='L'):
+        """Yield assembly lines for a statement tree, as each top-level statement completes.
+
+        statements may be any iterable, including a generator that parses
+        the program as it goes. Every statement is visited exactly once.
+        At -O3 the whole program goes through SSA form first, so nothing is
+        yielded until the last statement has been parsed. With source_map
+        set, the code of each statement follows a comment giving its source
+        location. Stores the optimizer holds back keep their own statement's
+        location; code hoisted out of a loop is credited to the loop.
+        """
+        if self.optimization_level >= 3:
+            yield from self._generate_ssa(statements, label_prefix)
+            return
         assembly_instructions = []
-        parse_instruction = []
         register_counter = 0
         label_counter = 0
-        token_stack = []
-        current_keyword = None
-        current_lhs = None  # To track variable assignment
-        rhs_stack = []      # To process RHS expressions
+        location = None
+        trace = self.trace
+        source_map = self.source_map
+        optimizer = Optimizer(self.optimization_level) if self.optimization_level else None
+        loop_optimizer = LoopOptimizer() if self.optimization_level >= 2 else None
 
         def allocate_register():
             nonlocal register_counter
@@ -133,153 +401,247 @@ class TwoPassCompiler:
 
         def generate_label():
             nonlocal label_counter
-            label = f"L{label_counter}"
+            label = f"{label_prefix}{label_counter}"
             label_counter += 1
             return label
 
-        def handle_if(tokens):
-            print(tokens)
-            tokens.reverse()  # Reverse to process right-to-left
-            lhs, operator, rhs = None, None, None
-
-            while tokens:
-                token_kind, token_value = tokens.pop()
-                if token_kind == 'ID' or token_kind == 'NUMBER':
-                    reg = allocate_register()
-                    if token_kind == 'ID':
-                        assembly_instructions.append(f"LOAD {reg}, {token_value}")
-                    else:
-                        assembly_instructions.append(f"LOAD {reg}, #{token_value}")
-
-                    if lhs is None:
-                        lhs = reg
-                    else:
-                        rhs = reg
-                elif token_kind in ['GT', 'LT', 'EQ']:
-                    operator = token_kind
-                elif token_kind in ['LPAREN', 'RPAREN']:
-                    continue
-                else:
-                    raise ValueError(f"Unexpected token in 'if' condition: {token_kind}")
-
-            if not (lhs and operator and rhs):
-                raise ValueError("Incomplete condition in 'if' statement.")
-
-            op_map = {'GT': 'CMP_GT', 'LT': 'CMP_LT', 'EQ': 'CMP_EQ'}
-            assembly_operator = op_map.get(operator)
-            if not assembly_operator:
-                raise ValueError(f"Unsupported operator in 'if': {operator}")
-
-            end_label = generate_label()
-            assembly_instructions.append(f"{assembly_operator} {lhs}, {rhs}")
-            assembly_instructions.append(f"JUMP_IF_FALSE {end_label}")
-            return end_label
-
-        # Define keyword handlers
-        keyword_handlers = {
-            'if': handle_if,
-        }
-
-        def process_rhs():
-            """Process the RHS stack into assembly instructions."""
-            while len(rhs_stack) > 1:
-                operand1 = rhs_stack.pop(0)
-                operator = rhs_stack.pop(0)
-                operand2 = rhs_stack.pop(0)
-
-                op_map = {'PLUS': 'ADD', 'MINUS': 'SUB', 'MUL': 'MUL', 'DIV': 'DIV'}
-                if operator not in op_map:
-                    raise ValueError(f"Invalid operator: {operator}")
-
-                assembly_operator = op_map[operator]
-                temp_reg = operand1  # Use operand1 as the destination to avoid unnecessary allocation
-                assembly_instructions.append(f"{assembly_operator} {temp_reg}, {operand2}")
-                rhs_stack.insert(0, temp_reg)  # Push result back as the single remaining operand
-
-            if rhs_stack:
-                return rhs_stack.pop(0)  # Final register holding the RHS value
-            return None
-
-
-        # Main loop to process instructions
-        for kind, value in self.instructions:
-            print(f"kind: {kind} value: {value}")
-            if kind == 'KEYWORD':
-                if value in keyword_handlers:
-                    if current_keyword:
-                        keyword_handlers[current_keyword](token_stack)
-                        token_stack = []
-                    current_keyword = value
-            elif kind == 'NEWLINE':
-                if current_keyword:
-                    keyword_handlers[current_keyword](token_stack)
-                    current_keyword = None
-                    token_stack = []
-                elif current_lhs:
-                    # Finalize variable assignment
-                    final_value = process_rhs()
-                    if final_value:
-                        assembly_instructions.append(f"STORE {current_lhs}, {final_value}")
-                    current_lhs = None
-            elif current_keyword:
-                # Collect tokens for the current keyword
-                token_stack.append((kind, value))
+        def mark(statement):
+            """Credit the instructions that follow to statement's source location."""
+            mark_location(statement.location)
+
+        def mark_location(at):
+            nonlocal location
+            if source_map and at is not None and at != location:
+                location = at
+                assembly_instructions.append(location_comment(location))
+
+        def emit_assignment(lhs, expression):
+            assembly_instructions.append(f"; Assigning value to {lhs}")
+            if expression is not None:
+                result = emit_expression(expression, allocate_register, assembly_instructions.append)
+                assembly_instructions.append(f"STORE {lhs}, {result}")
+
+        def emit_optimized(statements):
+            for lhs, expression, at in statements:
+                # A store the optimizer held back keeps the location of its own statement
+                mark_location(at)
+                emit_assignment(lhs, expression)
+
+        def visit_assignment(statement):
+            if optimizer:
+                emit_optimized(optimizer.assignment(statement.lhs, statement.rhs, statement.location))
             else:
-                # Handle non-keyword instructions
-                if kind == 'ID':  # Variable names
-                    if current_lhs is None:
-                        current_lhs = value  # Assign LHS
-                    else:
-                        rhs_stack.append(value)  # Add to RHS stack
-                elif kind == 'ASSIGN':  # Assignment operator
-                    assembly_instructions.append(f"; Assigning value to {current_lhs}")
-                elif kind == 'NUMBER':  # Numbers
-                    reg = allocate_register()
-                    assembly_instructions.append(f"LOAD {reg}, #{value}")
-                    rhs_stack.append(reg)
-                elif kind in ['PLUS', 'MINUS', 'MUL', 'DIV']:  # Operators
-                    rhs_stack.append(kind)
-
-        # Handle any remaining keyword or variable assignment
-        if current_keyword:
-            keyword_handlers[current_keyword](token_stack)
-        elif current_lhs:
-            final_value = process_rhs()
-            if final_value:
-                assembly_instructions.append(f"STORE {current_lhs}, {final_value}")
-
-        return "\n".join(assembly_instructions)
-
-
-
-
-
-
-
-
-
-
-
-
+                mark(statement)
+                emit_assignment(statement.lhs, statement.rhs)
+
+        def emit_branch_if_false(condition, false_label):
+            """Emit a test of condition that jumps to false_label when it does not hold."""
+            left = emit_expression(condition.left, allocate_register, assembly_instructions.append)
+            right = emit_expression(condition.right, allocate_register, assembly_instructions.append)
+            if condition.op == 'GEQ':
+                # There is no CMP_GE, so leave when left < right instead
+                true_label = generate_label()
+                assembly_instructions.append(f"CMP_LT {left}, {right}")
+                assembly_instructions.append(f"JUMP_IF_FALSE {true_label}")
+                assembly_instructions.append(f"JUMP {false_label}")
+                assembly_instructions.append(f"{true_label}:")
+            else:
+                assembly_instructions.append(f"{COMPARE_OPCODES[condition.op]} {left}, {right}")
+                assembly_instructions.append(f"JUMP_IF_FALSE {false_label}")
+
+        def flush():
+            """End a basic block for the optimizer: facts from it may not hold on every path out."""
+            if optimizer:
+                emit_optimized(optimizer.barrier())
+
+        def visit_if(statement):
+            if trace:
+                trace('if', statement.condition)
+            flush()
+            mark(statement)
+            end_label = generate_label()
+            else_label = generate_label() if statement.orelse else end_label
+            emit_branch_if_false(statement.condition, else_label)
+            visit_block(statement.body)
+            flush()
+            if statement.orelse:
+                mark(statement)
+                assembly_instructions.append(f"JUMP {end_label}")
+                assembly_instructions.append(f"{else_label}:")
+                visit_block(statement.orelse)
+                flush()
+            assembly_instructions.append(f"{end_label}:")
+
+        def visit_while(statement):
+            if trace:
+                trace('while', statement.condition)
+            flush()
+            mark(statement)
+            head_label = generate_label()
+            end_label = generate_label()
+            assembly_instructions.append(f"{head_label}:")
+            emit_branch_if_false(statement.condition, end_label)
+            visit_block(statement.body)
+            flush()
+            mark(statement)
+            assembly_instructions.append(f"JUMP {head_label}")
+            assembly_instructions.append(f"{end_label}:")
+
+        visitors = {Assignment: visit_assignment, If: visit_if, While: visit_while}
+
+        def visit_block(statements):
+            for statement in statements:
+                visitors[type(statement)](statement)
+
+        for statement in statements:
+            if loop_optimizer:
+                statement = loop_optimizer.statement(statement)
+            if trace:
+                trace('statement', statement)
+            visitors[type(statement)](statement)
+            # The statement is complete, so its code can be handed out
+            yield from assembly_instructions
+            assembly_instructions.clear()
+        if optimizer:
+            emit_optimized(optimizer.finish())
+        if trace and loop_optimizer:
+            trace('loops', loop_optimizer)
+        yield from assembly_instructions
+
+    def _generate_ssa(self, statements, label_prefix):
+        """Yield assembly for statements via the SSA form in ssa.py, with global value numbering."""
+        loop_optimizer = LoopOptimizer()
+        tree = []
+        for statement in statements:
+            statement = loop_optimizer.statement(statement)
+            if self.trace:
+                self.trace('statement', statement)
+            tree.append(statement)
+        program = SSAProgram(tree).optimize(self.num_registers)
+        lines = program.emit(label_prefix, self.num_registers, self.source_map)
+        if self.trace:
+            self.trace('loops', loop_optimizer)
+            self.trace('ssa', program)
+        yield from lines
 
     def _get_indentation(self):
         return "    " * self.indentation_level  # Generates indentation based on the level
 
     # Compile the source code using both passes
-    def compile(self, code):
+    def compile(self, code, stats=None):
+        return self.compile_session(code, stats).assembly
+
+    def compile_session(self, code, stats=None, label_prefix='L'):
+        """Compile code and return its CompileSession, including the tokens and parse."""
         # Perform the first pass: Tokenization and parsing
-        self.first_pass(code)
-        
+        session = self._analyze(code, stats)
+
         # Perform the second pass: Code generation
-        python_code = self.second_pass()
-        
-        # Print the generated Python code
-        print("Generated Assembly Code:\n", python_code)
+        session.assembly = self.second_pass(session.parsed_output, stats, label_prefix)
+
+        if self.trace:
+            self.trace('assembly', session.assembly)
+        return session
+
+    def compile_to_python(self, code, stats=None):
+        """Compile code into a Python code object; run it with python_backend.run()."""
+        session = self._analyze(code, stats)
+        if stats is None:
+            stats = CompileStats()
+        with stats.phase('codegen') as codegen:
+            module = lower_program(session.parsed_output)
+            python_code = compile(module, '<program>', 'exec')
+            codegen.count += len(module.body)
         return python_code
 
+    def compile_stream(self, source):
+        """Compile incrementally, yielding assembly lines as each statement completes.
+
+        source is either a string or an iterable of lines such as an open file;
+        "\n".join() over the result is identical to compile(source).
+        """
+        if isinstance(source, str):
+            # Only '\n' ends a line, as in compile(); str.splitlines() would also split on '\r' and others
+            source = io.StringIO(source, newline='\n')
+        assembly = self._generate_assembly(self._parse_stream(source))
+        if self.num_registers:
+            # Allocation needs liveness over the whole program, so this stage
+            # holds the output back until the source is exhausted.
+            assembly = self._allocate_registers(list(assembly), CompileStats())
+        return iter(assembly)
+
+    def _parse_stream(self, lines):
+        """Yield the statements of an iterable of source lines, parsing one top-level statement at a time.
+
+        Statements are grouped by split_statements(), so only one top-level
+        statement's source is held at once.
+        """
+        for first_line, pending in split_statements(lines):
+            yield from self.parse_instructions(lex(''.join(pending), self.keywords, first_line))
+
+
+def main(argv=None):
+    """Stream-compile a source file (or stdin) to assembly on stdout."""
+    parser = argparse.ArgumentParser(description='Compile a program to assembly.')
+    parser.add_argument('source', help="source file to compile, or '-' to read stdin")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log tokens and compiler events to stderr')
+    parser.add_argument('-r', '--registers', type=int, metavar='N',
+                        help='allocate onto N physical registers, spilling to the stack as needed')
+    parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2, 3], default=0,
+                        help='optimization level: -O1 folds and propagates constants, '
+                             '-O2 also removes dead stores and hoists invariants out of loops, '
+                             '-O3 also removes redundant loads and arithmetic through SSA form')
+    parser.add_argument('--bytecode', metavar='PATH',
+                        help='write binary bytecode to PATH instead of assembly to stdout')
+    parser.add_argument('--source-map', action='store_true',
+                        help="precede each statement's code with a '; line L:C' comment giving its source location")
+    parser.add_argument('--report', action='store_true',
+                        help='print the instruction count before and after optimization to stderr')
+    args = parser.parse_args(argv)
+    if args.report and args.source == '-':
+        parser.error('--report needs a source file')
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    compiler = TwoPassCompiler(trace=log_trace if args.verbose else None, num_registers=args.registers,
+                               optimization_level=args.optimization_level, source_map=args.source_map)
+    if args.bytecode:
+        # Bytecode needs every label before it can be written, so the program is compiled whole
+        import bytecode
+        if args.source == '-':
+            code = sys.stdin.read()
+        else:
+            with open(args.source, encoding='utf-8') as source:
+                code = source.read()
+        bytecode.write(args.bytecode, compiler.compile(code))
+        return 0
+    if args.source == '-':
+        sys.stdout.writelines(line + '\n' for line in compiler.compile_stream(sys.stdin))
+        return 0
+
+    # Files are read line by line through a buffered reader, so memory use
+    # stays bounded however large the program is.
+    with open(args.source, encoding='utf-8', buffering=1 << 16) as source:
+        assembly = compiler.compile_stream(source)
+        if args.report:
+            assembly = list(assembly)
+        sys.stdout.writelines(line + '\n' for line in assembly)
+    if args.report:
+        with open(args.source, encoding='utf-8', buffering=1 << 16) as source:
+            before = instruction_count(TwoPassCompiler(num_registers=args.registers).compile_stream(source))
+        after = instruction_count(assembly)
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"instructions: {before} at -O0, {after} at -O{args.optimization_level} ({change:+.1f}%)",
+              file=sys.stderr)
+    return 0
+
 
 # Example usage
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
     code = "x = 9"
     code2 = "x = 10 + 7"
     code3 = "y = 9 * 2"
@@ -290,7 +652,7 @@ if __name__ == '__main__':
     code5 = """
         x = 9
         if (x > 7) 
-        y = 12
+            y = 12
     """
     # Error generation
     ecode2 = """
@@ -301,7 +663,11 @@ if __name__ == '__main__':
         if 
     """
 
-    
-    compiler = TwoPassCompiler()
-    compiled_code = compiler.compile(code5)
+
+    logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    compiler = TwoPassCompiler(trace=log_trace)
+    stats = CompileStats()
+    compiled_code = compiler.compile(code5, stats)
+    print(compiled_code)
+    print(stats.report())
 
@@ -0,0 +1,440 @@
+import argparse
+import sys
+import time
+from collections import Counter
+
+from cfg import split_instruction
+from expressions import LOCATION_PREFIX
+
+# Opcode -> how each operand is decoded: 'reg' (R<n>), 'imm' (#<n>), 'var' (name),
+# 'src' (imm or var), 'label' (jump target), 'slot' ([sp+<n>])
+OPERAND_KINDS = {
+    'LOAD': ('reg', 'src'),
+    'STORE': ('var', 'reg'),
+    'MOVE': ('reg', 'reg'),
+    'ADD': ('reg', 'reg'),
+    'SUB': ('reg', 'reg'),
+    'MUL': ('reg', 'reg'),
+    'DIV': ('reg', 'reg'),
+    'CMP_GT': ('reg', 'reg'),
+    'CMP_LT': ('reg', 'reg'),
+    'CMP_EQ': ('reg', 'reg'),
+    'JUMP': ('label',),
+    'JUMP_IF_FALSE': ('label',),
+    'SPILL': ('slot', 'reg'),
+    'RELOAD': ('reg', 'slot'),
+}
+
+
+class Program:
+    """Assembly decoded into (opcode, a, b) tuples with labels resolved to indices."""
+
+    def __init__(self, code, lines, labels, num_registers, num_slots, locations=None):
+        self.code = code
+        self.lines = lines  # Source assembly text of each instruction, for error messages
+        self.labels = labels
+        self.num_registers = num_registers
+        self.num_slots = num_slots
+        # (line, col) in the program's source of each instruction, or None where unknown
+        self.locations = locations if locations is not None else [None] * len(code)
+
+    def __len__(self):
+        return len(self.code)
+
+
+def assemble(assembly):
+    """Decode assembly text (a string or an iterable of lines) into a Program.
+
+    A label that is referenced but never defined resolves to the end of the
+    program, so jumping to it halts; it is recorded in Program.labels as such.
+    A '; line L:C' comment, as the compiler writes with source_map set, maps
+    the instructions after it to that source location in Program.locations.
+    """
+    if isinstance(assembly, str):
+        assembly = assembly.splitlines()
+    pending = []
+    locations = []
+    location = None
+    labels = {}
+    for line in assembly:
+        stripped = line.strip()
+        if stripped.startswith(LOCATION_PREFIX):
+            line_num, _, col = stripped[len(LOCATION_PREFIX):].partition(':')
+            if line_num.isdigit() and col.isdigit():
+                location = (int(line_num), int(col))
+            continue
+        if not stripped or stripped.startswith(';'):
+            continue
+        if stripped.endswith(':'):
+            labels[stripped[:-1]] = len(pending)
+            continue
+        pending.append(stripped)
+        locations.append(location)
+
+    code = []
+    num_registers = num_slots = 0
+    for line in pending:
+        opcode, operands = split_instruction(line)
+        kinds = OPERAND_KINDS.get(opcode)
+        if kinds is None:
+            raise ValueError(f"Unknown instruction: {line}")
+        if len(operands) != len(kinds):
+            raise ValueError(f"Wrong number of operands: {line}")
+        decoded = []
+        for kind, operand in zip(kinds, operands):
+            if kind == 'reg':
+                if not operand.startswith('R') or not operand[1:].isdigit():
+                    raise ValueError(f"Expected a register, got {operand!r}: {line}")
+                number = int(operand[1:])
+                num_registers = max(num_registers, number + 1)
+                decoded.append(number)
+            elif kind == 'slot':
+                number = int(operand[len('[sp+'):-1])
+                num_slots = max(num_slots, number + 1)
+                decoded.append(number)
+            elif kind == 'label':
+                decoded.append(labels.setdefault(operand, len(pending)))
+            elif kind == 'src' and operand.startswith('#'):
+                opcode = 'LOAD_IMM'
+                decoded.append(int(operand[1:]))
+            else:
+                decoded.append(operand)
+        decoded.extend([None] * (2 - len(decoded)))
+        code.append((opcode, decoded[0], decoded[1]))
+    return Program(code, pending, labels, num_registers, num_slots, locations)
+
+
+class VirtualMachine:
+    """Executes a Program with a table of pre-bound handlers.
+
+    Every instruction is bound to its handler once, when the machine is
+    created; the dispatch loop then only fetches a (handler, a, b) triple,
+    calls it and counts the executed program counter. Handlers return the
+    next program counter. A profiling run also times every instruction,
+    for profile_report() and collapsed_stacks().
+    """
+
+    def __init__(self, program):
+        if not hasattr(program, 'code'):  # Assembly text; checked by duck type since vm.py may also run as __main__
+            program = assemble(program)
+        self.program = program
+        self.registers = [0] * program.num_registers
+        self.stack = [0] * program.num_slots
+        self.variables = {}
+        self.flag = [False]
+        self.counts = [0] * len(program)  # Executions of each instruction
+        self.costs = [0] * len(program)  # Nanoseconds spent in each instruction by profiling runs
+        self.steps = 0
+        self.seconds = 0.0
+        handlers = self._handlers()
+        self.code = [(handlers[opcode], a, b) for opcode, a, b in program.code]
+
+    def _handlers(self):
+        regs = self.registers
+        stack = self.stack
+        variables = self.variables
+        flag = self.flag
+
+        def load_imm(pc, d, value):
+            regs[d] = value
+            return pc + 1
+
+        def load(pc, d, name):
+            regs[d] = variables[name]
+            return pc + 1
+
+        def store(pc, name, s):
+            variables[name] = regs[s]
+            return pc + 1
+
+        def move(pc, d, s):
+            regs[d] = regs[s]
+            return pc + 1
+
+        def add(pc, d, s):
+            regs[d] += regs[s]
+            return pc + 1
+
+        def sub(pc, d, s):
+            regs[d] -= regs[s]
+            return pc + 1
+
+        def mul(pc, d, s):
+            regs[d] *= regs[s]
+            return pc + 1
+
+        def div(pc, d, s):
+            regs[d] //= regs[s]
+            return pc + 1
+
+        def cmp_gt(pc, a, b):
+            flag[0] = regs[a] > regs[b]
+            return pc + 1
+
+        def cmp_lt(pc, a, b):
+            flag[0] = regs[a] < regs[b]
+            return pc + 1
+
+        def cmp_eq(pc, a, b):
+            flag[0] = regs[a] == regs[b]
+            return pc + 1
+
+        def jump(pc, target, _):
+            return target
+
+        def jump_if_false(pc, target, _):
+            return pc + 1 if flag[0] else target
+
+        def spill(pc, slot, s):
+            stack[slot] = regs[s]
+            return pc + 1
+
+        def reload(pc, d, slot):
+            regs[d] = stack[slot]
+            return pc + 1
+
+        return {
+            'LOAD_IMM': load_imm, 'LOAD': load, 'STORE': store, 'MOVE': move,
+            'ADD': add, 'SUB': sub, 'MUL': mul, 'DIV': div,
+            'CMP_GT': cmp_gt, 'CMP_LT': cmp_lt, 'CMP_EQ': cmp_eq,
+            'JUMP': jump, 'JUMP_IF_FALSE': jump_if_false,
+            'SPILL': spill, 'RELOAD': reload,
+        }
+
+    def reset(self, variables=None):
+        """Clear machine state (but not the execution counters) before a run."""
+        self.registers[:] = [0] * len(self.registers)
+        self.stack[:] = [0] * len(self.stack)
+        self.variables.clear()
+        if variables:
+            self.variables.update(variables)
+        self.flag[0] = False
+
+    def run(self, variables=None, max_steps=None, profile=False):
+        """Run the program from the start and return its variables.
+
+        With profile set, the time spent in each instruction is added to
+        costs. That includes the cost of reading the clock, so a profiling
+        run is several times slower and its costs are only comparable with
+        each other.
+        """
+        self.reset(variables)
+        code = self.code
+        counts = self.counts
+        end = len(code)
+        pc = 0
+        steps = 0
+        start = time.perf_counter()
+        try:
+            if profile:
+                costs = self.costs
+                clock = time.perf_counter_ns
+                while pc < end:
+                    if steps == max_steps:
+                        raise RuntimeError(f"Step limit of {max_steps} exceeded")
+                    counts[pc] += 1
+                    handler, a, b = code[pc]
+                    began = clock()
+                    next_pc = handler(pc, a, b)
+                    costs[pc] += clock() - began
+                    pc = next_pc
+                    steps += 1
+            elif max_steps is None:
+                while pc < end:
+                    counts[pc] += 1
+                    handler, a, b = code[pc]
+                    pc = handler(pc, a, b)
+                    steps += 1
+            else:
+                while pc < end:
+                    if steps == max_steps:
+                        raise RuntimeError(f"Step limit of {max_steps} exceeded")
+                    counts[pc] += 1
+                    handler, a, b = code[pc]
+                    pc = handler(pc, a, b)
+                    steps += 1
+        except KeyError as error:
+            raise RuntimeError(f"Variable {error.args[0]!r} read before assignment at "
+                               f"{self.program.lines[pc]!r}") from None
+        except ZeroDivisionError:
+            raise RuntimeError(f"Division by zero at {self.program.lines[pc]!r}") from None
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.steps += steps
+        # Names starting with '.' are compiler temporaries, which no program can name
+        return {name: value for name, value in self.variables.items() if not name.startswith('.')}
+
+    @property
+    def instructions_per_second(self):
+        return self.steps / self.seconds if self.seconds else 0.0
+
+    def opcode_counts(self):
+        """Return how many times each opcode has executed, over all runs."""
+        totals = Counter()
+        for (opcode, _, _), count in zip(self.program.code, self.counts):
+            if count:
+                totals['LOAD' if opcode == 'LOAD_IMM' else opcode] += count
+        return totals
+
+    def line_profile(self):
+        """Return {location: (executions, nanoseconds)} summed over the instructions of each source location.
+
+        Instructions with no known location are gathered under None.
+        """
+        totals = {}
+        for location, count, cost in zip(self.program.locations, self.counts, self.costs):
+            if count:
+                executions, nanoseconds = totals.get(location, (0, 0))
+                totals[location] = (executions + count, nanoseconds + cost)
+        return totals
+
+    def profile_report(self, source=None, limit=20):
+        """Return the source lines and the instructions that cost the most, as text.
+
+        Both tables are sorted by time, or by executions if no run was
+        profiled; limit caps how many rows each shows (None for all).
+        source, the program's text, adds each line's code to the report.
+        """
+        source_lines = source.splitlines() if source is not None else []
+        timed = any(self.costs)
+        total_cost = sum(self.costs) or 1
+        total_count = sum(self.counts) or 1
+
+        def share(count, cost):
+            return cost / total_cost if timed else count / total_count
+
+        def text(location):
+            if location is None:
+                return "(no source location)"
+            line_num, col = location
+            code = source_lines[line_num - 1].strip() if 0 < line_num <= len(source_lines) else ""
+            return f"{line_num}:{col}  {code}".rstrip()
+
+        lines = [f"{self.steps} instructions in {self.seconds * 1000:.3f} ms"
+                 + ("" if timed else " (not profiled; sorted by executions)"),
+                 "", f"{'executions':>12} {'ms':>10} {'share':>7}  source line"]
+        rows = sorted(self.line_profile().items(), key=lambda item: item[1][::-1] if timed else item[1],
+                      reverse=True)
+        for location, (count, cost) in rows[:limit]:
+            lines.append(f"{count:>12,} {cost / 1e6:>10.3f} {share(count, cost):>7.1%}  {text(location)}")
+        lines += ["", f"{'executions':>12} {'ms':>10} {'share':>7}  {'pc':>6}  instruction"]
+        rows = sorted(range(len(self.program)), key=lambda pc: (self.costs[pc], self.counts[pc]) if timed
+                      else (self.counts[pc], self.costs[pc]), reverse=True)
+        for pc in rows[:limit]:
+            count, cost = self.counts[pc], self.costs[pc]
+            if not count:
+                break
+            location = self.program.locations[pc]
+            where = f"  (line {location[0]})" if location else ""
+            lines.append(f"{count:>12,} {cost / 1e6:>10.3f} {share(count, cost):>7.1%}  {pc:>6}  "
+                         f"{self.program.lines[pc]}{where}")
+        return "\n".join(lines)
+
+    def collapsed_stacks(self, source=None):
+        """Yield the profile in the collapsed-stack format that flamegraph.pl and speedscope read.
+
+        Each line is 'program;<frames>;<instruction> <weight>', where the
+        frames are the source lines enclosing the instruction's line (found
+        from source's indentation, when it is given) and then the line
+        itself. The weight is nanoseconds, or executions if no run was
+        profiled.
+        """
+        source_lines = source.splitlines() if source is not None else []
+        parents = _enclosing_lines(source_lines)
+        timed = any(self.costs)
+
+        def frame(line_num):
+            if 0 < line_num <= len(source_lines):
+                return f"line {line_num}: {source_lines[line_num - 1].strip()}"
+            return f"line {line_num}"
+
+        for pc, (count, cost) in enumerate(zip(self.counts, self.costs)):
+            weight = cost if timed else count
+            if not weight:
+                continue
+            location = self.program.locations[pc]
+            if location is None:
+                frames = ["(no source location)"]
+            else:
+                frames = [frame(line_num) for line_num in parents.get(location[0], ())] + [frame(location[0])]
+            yield f"program;{';'.join(frames)};{pc}: {self.program.lines[pc]} {weight}"
+
+    def report(self):
+        lines = [f"{self.steps} instructions in {self.seconds * 1000:.3f} ms "
+                 f"({self.instructions_per_second:,.0f} instructions/sec)"]
+        for opcode, count in self.opcode_counts().most_common():
+            lines.append(f"  {opcode:<14} {count:>12}")
+        return "\n".join(lines)
+
+
+def _enclosing_lines(source_lines):
+    """Return {line number: line numbers of the less indented lines enclosing it, outermost first}."""
+    parents = {}
+    stack = []  # (indent, line number) of the lines enclosing the current one
+    for line_num, line in enumerate(source_lines, 1):
+        stripped = line.lstrip(' \t')
+        if not stripped.strip():
+            continue
+        indent = len(line) - len(stripped)
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        parents[line_num] = [number for _, number in stack]
+        stack.append((indent, line_num))
+    return parents
+
+
+def main(argv=None):
+    """Run an assembly file, or compile and run a source file, and print the final variables."""
+    parser = argparse.ArgumentParser(description='Execute compiler assembly output.')
+    parser.add_argument('program', help='assembly or bytecode file, or a source file with --source')
+    parser.add_argument('-s', '--source', action='store_true', help='compile the program first')
+    parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2, 3], default=0,
+                        help='optimization level when compiling with --source')
+    parser.add_argument('-r', '--registers', type=int, metavar='N',
+                        help='register file size when compiling with --source')
+    parser.add_argument('-n', '--repeat', type=int, default=1, help='run the program this many times')
+    parser.add_argument('--stats', action='store_true', help='print execution counters to stderr')
+    parser.add_argument('--profile', action='store_true',
+                        help='time every instruction and print the costliest source lines and instructions to stderr')
+    parser.add_argument('--flamegraph', metavar='PATH',
+                        help='profile, and write the costs as collapsed stacks for flamegraph.pl to PATH')
+    parser.add_argument('--listing', metavar='SOURCE',
+                        help="source file of an assembly program compiled with '--source-map', for the profile")
+    args = parser.parse_args(argv)
+    profile = args.profile or args.flamegraph is not None
+
+    import bytecode
+    source = None
+    if args.listing:
+        with open(args.listing, encoding='utf-8') as f:
+            source = f.read()
+    if not args.source and bytecode.is_bytecode(args.program):
+        with bytecode.load(args.program) as image:
+            program = image.to_program()
+    else:
+        with open(args.program, encoding='utf-8') as f:
+            text = f.read()
+        if args.source:
+            from two_pass_comp import TwoPassCompiler
+            source = text
+            text = TwoPassCompiler(num_registers=args.registers, optimization_level=args.optimization_level,
+                                   source_map=profile).compile(text)
+        program = assemble(text)
+
+    machine = VirtualMachine(program)
+    for _ in range(args.repeat):
+        variables = machine.run(profile=profile)
+    for name, value in sorted(variables.items()):
+        print(f"{name} = {value}")
+    if args.stats:
+        print(machine.report(), file=sys.stderr)
+    if args.profile:
+        print(machine.profile_report(source), file=sys.stderr)
+    if args.flamegraph:
+        with open(args.flamegraph, 'w', encoding='utf-8') as f:
+            f.writelines(line + '\n' for line in machine.collapsed_stacks(source))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())